@@ -1,31 +1,99 @@
 import os
-from dotenv import load_dotenv
+from types import MappingProxyType
+from typing import Mapping, Optional
 
-# Load dotenv file
-load_dotenv(".env")
+# Environment variables are read once, at import time. Loading the .env file is up to
+# the entry point, which has to do it before importing this module.
+_GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+_QDRANT_LOCATION = os.environ.get("QDRANT_LOCATION", "http://localhost:6333")
+_QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY") or None
+_OBSIDIAN_VAULT_PATH = os.environ.get("OBSIDIAN_VAULT_PATH")
+_NOTION_API_KEY = os.environ.get("NOTION_API_KEY")
+_AGENTOPS_API_KEY = os.environ.get("AGENTOPS_API_KEY") or None
+_GMAIL_PUBSUB_TOPIC = os.environ.get("GMAIL_PUBSUB_TOPIC") or None
+_GMAIL_PUBSUB_SUBSCRIPTION = os.environ.get("GMAIL_PUBSUB_SUBSCRIPTION") or None
 
-# Embedder configuration
-embedder_config = {
-    "provider": "google",
-    "config": {
-        "api_key": os.environ.get("GEMINI_API_KEY"),
-        "model": "models/text-embedding-004",
-    },
-}
 
-# Qdrant configuration
-qdrant_location = os.environ.get("QDRANT_LOCATION", "http://localhost:6333")
-qdrant_api_key = os.environ.get("QDRANT_API_KEY") or None
-qdrant_collection_name = "knowledge-base"
+def _freeze(mapping: Mapping) -> Mapping:
+    return MappingProxyType(
+        {
+            key: _freeze(value) if isinstance(value, Mapping) else value
+            for key, value in mapping.items()
+        }
+    )
 
-# Obsidian configuration
-obsidian_vault_path = os.environ.get("OBSIDIAN_VAULT_PATH")
 
-#Notion configuration
-notion_api_key = os.environ.get("NOTION_API_KEY")
+def _thaw(mapping: Mapping) -> dict:
+    return {
+        key: _thaw(value) if isinstance(value, Mapping) else value
+        for key, value in mapping.items()
+    }
 
-# Add Notion database ID (formatted with hyphens)
-notion_database_id = "18546dc7-ebc3-808d-ba04-c485aa46572b"
 
-# AgentOps configuration
-agentops_api_key = os.environ.get("AGENTOPS_API_KEY") or None
+class Settings:
+    """
+    Process-wide configuration of the assistant. The instance is a singleton built
+    from the environment captured at import time.
+    """
+
+    _instance: Optional["Settings"] = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, collection_name: Optional[str] = None):
+        if getattr(self, "_initialized", False):
+            # Allow the entry points to override the collection of the shared instance
+            if collection_name is not None:
+                self.qdrant_collection_name = collection_name
+            return
+
+        # Embedder configuration, read-only as it is shared by all the threads
+        self.embedder_config = _freeze(
+            {
+                "provider": "google",
+                "config": {
+                    "api_key": _GEMINI_API_KEY,
+                    "model": "models/text-embedding-004",
+                },
+            }
+        )
+
+        # Qdrant configuration
+        self.qdrant_location = _QDRANT_LOCATION
+        self.qdrant_api_key = _QDRANT_API_KEY
+        self.qdrant_collection_name = collection_name or "knowledge-base"
+
+        # Obsidian configuration
+        self.obsidian_vault_path = _OBSIDIAN_VAULT_PATH
+
+        # Notion configuration
+        self.notion_api_key = _NOTION_API_KEY
+
+        # Add Notion database ID (formatted with hyphens)
+        self.notion_database_id = "18546dc7-ebc3-808d-ba04-c485aa46572b"
+
+        # Gmail push notifications, the inbox is only polled if they are not set
+        self.gmail_pubsub_topic = _GMAIL_PUBSUB_TOPIC
+        self.gmail_pubsub_subscription = _GMAIL_PUBSUB_SUBSCRIPTION
+
+        # AgentOps configuration
+        self.agentops_api_key = _AGENTOPS_API_KEY
+
+        self._initialized = True
+
+    def __getstate__(self):
+        # Mapping proxies cannot be pickled, but the settings are sent to the spawned
+        # worker processes
+        state = self.__dict__.copy()
+        state["embedder_config"] = _thaw(self.embedder_config)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.embedder_config = _freeze(state["embedder_config"])
+
+
+settings = Settings()
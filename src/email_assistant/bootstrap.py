@@ -0,0 +1,318 @@
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Sync Notion content every 10 minutes
+NOTION_SYNC_INTERVAL_SEC = 600
+
+# The knowledge base keeps being synced, so the cached answers expire
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL_SEC = 300
+
+# The Notion sync runs in a separate process, so its CPU-bound work does not compete
+# with the web server for the GIL. Spawn avoids inheriting the threads of the parent.
+_SPAWN_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def load_notion_sync_state(path: Path) -> dict:
+    """
+    Load the state of the Notion sync, so a restart does not sync all the pages again.
+    :param path: the path to load the state from
+    :return: the loaded state, empty if there is no state yet
+    """
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_notion_sync_state(path: Path, state: dict) -> None:
+    """
+    Save the state of the Notion sync. The file is replaced atomically, so a crash
+    in the middle of the write does not corrupt the previous state.
+    :param path: the path to save the state to
+    :param state: the state to save
+    """
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(state))
+    tmp_path.replace(path)
+
+
+def run_notion_sync(
+    settings,
+    stop_event,
+    state_file: Optional[Path] = None,
+    sync_interval_sec: int = NOTION_SYNC_INTERVAL_SEC,
+):
+    """
+    Sync Notion content into the knowledge base until the stop event is set.
+    :param settings: the application settings
+    :param stop_event: the threading or multiprocessing event signalling the shutdown
+    :param state_file: the file keeping the sync cursor between the runs
+    :param sync_interval_sec: the time between the start of two sync cycles
+    """
+    # CrewAI and the Notion client are heavy to import, so only load them when used
+    from email_assistant.notion.handlers import NotionToQdrantHandler
+
+    # Bind the configuration once, so the sync loop does not re-read it
+    embedder_config = settings.embedder_config
+    notion_api_key = settings.notion_api_key
+    qdrant_location = settings.qdrant_location
+    qdrant_api_key = settings.qdrant_api_key
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Configuration values:")
+        logger.debug("Embedder config: %s", embedder_config)
+        logger.debug("Qdrant location: %s", qdrant_location)
+        logger.debug("Qdrant collection: %s", settings.qdrant_collection_name)
+        logger.debug("Notion API key present: %s", bool(notion_api_key))
+        logger.debug("Sync interval: %i seconds", sync_interval_sec)
+
+    logger.info("Initializing Notion sync")
+
+    handler = NotionToQdrantHandler(
+        notion_api_key=notion_api_key,
+        qdrant_location=qdrant_location,
+        qdrant_api_key=qdrant_api_key,
+        embedder_config=embedder_config,
+    )
+
+    # Only the pages edited since the last successful sync are processed
+    state = load_notion_sync_state(state_file) if state_file is not None else {}
+
+    try:
+        sync_count = 0
+        # Cycles are scheduled against monotonic deadlines, so the sync duration
+        # does not shift the cadence and a shutdown request wakes the loop immediately
+        next_deadline = time.monotonic()
+        while not stop_event.is_set():
+            try:
+                sync_count += 1
+                start_time = time.monotonic()
+                logger.info("Starting Notion sync cycle #%i", sync_count)
+
+                last_edited_time = handler.sync_notion_to_qdrant(
+                    since=state.get("last_edited_time")
+                )
+                if last_edited_time != state.get("last_edited_time"):
+                    state["last_edited_time"] = last_edited_time
+                    if state_file is not None:
+                        save_notion_sync_state(state_file, state)
+
+                duration = time.monotonic() - start_time
+                logger.info(
+                    "Sync cycle #%i completed in %.1f seconds", sync_count, duration
+                )
+            except Exception as e:
+                logger.error("Error during sync cycle #%i: %s", sync_count, e)
+
+            # Skip the missed cycles if the sync took longer than the interval
+            next_deadline = max(next_deadline + sync_interval_sec, time.monotonic())
+            wait_time = next_deadline - time.monotonic()
+            if logger.isEnabledFor(logging.INFO):
+                next_sync_at = time.strftime(
+                    "%H:%M:%S", time.localtime(time.time() + wait_time)
+                )
+                logger.info(
+                    "Next sync will run in %.1f minutes (at %s)",
+                    wait_time / 60,
+                    next_sync_at,
+                )
+            stop_event.wait(wait_time)
+    finally:
+        handler.close()
+        logger.info("Notion sync process terminated. Goodbye!")
+
+
+def create_stop_event():
+    """
+    Create an event which can be shared with the Notion sync process.
+    :return: the multiprocessing event
+    """
+    return _SPAWN_CONTEXT.Event()
+
+
+def _run_notion_sync_process(settings, stop_event, state_file):
+    # The parent process handles the interrupts and sets the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_notion_sync(settings, stop_event, state_file)
+
+
+def create_notion_sync_loop(
+    settings, stop_event, state_file: Optional[Path] = None
+) -> multiprocessing.Process:
+    """
+    Create a background process periodically syncing Notion into the knowledge base.
+    :param settings: the application settings
+    :param stop_event: the event signalling the shutdown, see create_stop_event
+    :param state_file: the file keeping the sync cursor between the runs
+    :return: the process running the sync loop, not started yet
+    """
+    return _SPAWN_CONTEXT.Process(
+        target=_run_notion_sync_process,
+        args=(settings, stop_event, state_file),
+        name="notion-sync",
+        daemon=True,
+    )
+
+
+def create_notion_querier(settings):
+    """
+    Create the querier answering the questions about the Notion content.
+    :param settings: the application settings
+    :return: the querier
+    :raises RuntimeError: if the Notion querier is not available
+    """
+    try:
+        from email_assistant.notion.query import NotionQuerier
+    except ImportError as e:
+        raise RuntimeError(
+            "The Notion querier is not implemented yet, use the gmail-obsidian mode"
+        ) from e
+
+    return NotionQuerier(
+        embedder_config=settings.embedder_config,
+        qdrant_location=settings.qdrant_location,
+        qdrant_api_key=settings.qdrant_api_key,
+    )
+
+
+def create_web_app(querier, template_folder: Path):
+    """
+    Create the web interface answering the questions with the given querier.
+    Flask is imported here, so it is only loaded when the web interface is used.
+    :param querier: the querier answering the questions
+    :param template_folder: the directory with the HTML templates
+    :return: the Flask application
+    """
+    import orjson
+    from cachetools import TTLCache
+    from flask import Flask, render_template, request, jsonify
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """
+        Encode and decode the JSON bodies with orjson instead of the stdlib json module.
+        """
+
+        def dumps(self, obj, **kwargs) -> str:
+            return orjson.dumps(obj, default=self.default).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app = Flask(__name__, template_folder=str(template_folder))
+    app.json = OrjsonProvider(app)
+
+    # Answering a question takes a full LLM round-trip, so the repeated questions
+    # are served from memory. Failed answers raise, so they are never cached.
+    answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL_SEC)
+    answer_cache_lock = threading.Lock()
+
+    def answer_question(question: str):
+        # Questions differing only in whitespace or case share the cache entry,
+        # but the LLM gets the question as it was asked
+        key = " ".join(question.split()).casefold()
+        with answer_cache_lock:
+            answer = answer_cache.get(key)
+        if answer is None:
+            answer = querier.ask_question(question)
+            with answer_cache_lock:
+                answer_cache[key] = answer
+        return answer
+
+    @app.route("/")
+    def home():
+        return render_template("chat.html")
+
+    @app.route("/ask", methods=["POST"])
+    def ask():
+        try:
+            question = request.json.get("question")
+            if not question:
+                return jsonify({"error": "No question provided"}), 400
+
+            answer = answer_question(question)
+            response = jsonify({"answer": answer})
+            response.headers["Cache-Control"] = (
+                f"private, max-age={ANSWER_CACHE_TTL_SEC}"
+            )
+            return response
+        except Exception as e:
+            logger.error("Error processing question: %s", e)
+            return jsonify({"error": str(e)}), 500
+
+    return app
+
+
+def create_gmail_listener(settings, working_dir: Path, state_file: Path):
+    """
+    Monitor the Gmail inbox for new emails and handle them accordingly.
+    :param settings: the application settings
+    :param working_dir: the directory with the Google API credentials
+    :param state_file: the file with the state of the previous run
+    :return: the listener thread, not started yet
+    """
+    from email_assistant.gmail.handlers import AgenticAutoReplyHandler
+    from email_assistant.gmail.inbox import GmailInboxListener, GmailInboxState
+
+    logger.info("Monitoring mailbox for new emails...")
+
+    # Load the previous state of the Gmail inbox
+    if state_file.exists():
+        gmail_state = GmailInboxState.load_state(state_file)
+    else:
+        # By default, our listener will process all the unread threads from the past.
+        # Please set process_all_unread_threads=False if you want to process only new threads.
+        gmail_state = GmailInboxState(process_all_unread_threads=True)
+
+    # Create an agentic auto-reply handler
+    auto_reply_handler = AgenticAutoReplyHandler(
+        settings.embedder_config,
+        settings.qdrant_location,
+        settings.qdrant_api_key,
+    )
+
+    # Start the listener so that it can monitor the mailbox
+    listener = GmailInboxListener(
+        working_dir,
+        state=gmail_state,
+        polling_time_sec=60,  # We poll every minute, unless notified earlier
+        pubsub_topic=settings.gmail_pubsub_topic,
+        pubsub_subscription=settings.gmail_pubsub_subscription,
+    )
+    listener.add_handler(auto_reply_handler)
+    return listener
+
+
+def create_filesystem_listener(settings):
+    """
+    Monitor the Obsidian Vault and keep the knowledge base in sync with it.
+    :param settings: the application settings
+    :return: the filesystem observer, not started yet
+    """
+    from watchdog.observers import Observer
+
+    from email_assistant.obsidian.handlers import AgenticObsidianVaultToQdrantHandler
+
+    logger.info("Monitoring Obsidian Vault %s", settings.obsidian_vault_path)
+
+    handler = AgenticObsidianVaultToQdrantHandler(
+        settings.embedder_config,
+        settings.qdrant_location,
+        settings.qdrant_api_key,
+    )
+
+    # Load the notes created while the listener was not running
+    handler.initialize(Path(settings.obsidian_vault_path))
+
+    observer = Observer()
+    observer.schedule(handler, settings.obsidian_vault_path, recursive=True)
+    return observer
@@ -1,6 +1,10 @@
 import abc
+import copy
+import functools
+from pathlib import Path
 from typing import Optional
 
+import yaml
 from crewai import Agent, Crew, Process, Task
 from crewai.memory import EntityMemory, ShortTermMemory
 from crewai.project import CrewBase, agent, crew, task
@@ -8,15 +12,26 @@ from crewai.tasks import TaskOutput
 from crewai.tasks.conditional_task import ConditionalTask
 
 from email_assistant import models
-from email_assistant.tools.qdrant_tool.tool import (
-    QdrantSearchTool,
-)
 from email_assistant.storage import QdrantStorage
+from email_assistant.tools.qdrant_tool.tool import QdrantSearchTool
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_yaml(config_path: Path) -> dict:
+    with open(config_path, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+def _load_yaml(config_path: Path) -> dict:
+    # CrewAI replaces the agent names in the loaded configs with the Agent objects,
+    # so every crew instance has to get its own copy of the parsed file
+    return copy.deepcopy(_parse_yaml(config_path))
 
 
 class BaseCrew(abc.ABC):
     """
-    Base class for the crews in the project.
+    Base class for the crews in the project. The Qdrant backed storages are created
+    once per crew instance and shared by all the agents and crews built from it.
     """
 
     def __init__(
@@ -29,6 +44,14 @@ class BaseCrew(abc.ABC):
         self.qdrant_location = qdrant_location
         self.qdrant_api_key = qdrant_api_key
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # @CrewBase wraps the crew into a subclass which parses the agents and tasks
+        # YAML files on every instantiation. Parse each of them once per process.
+        if "load_yaml" in cls.__dict__:
+            cls.load_yaml = staticmethod(_load_yaml)
+
+    @functools.cached_property
     def entity_memory(self) -> EntityMemory:
         return EntityMemory(
             storage=QdrantStorage(
@@ -39,6 +62,7 @@ class BaseCrew(abc.ABC):
             ),
         )
 
+    @functools.cached_property
     def short_term_memory(self) -> ShortTermMemory:
         return ShortTermMemory(
             storage=QdrantStorage(
@@ -49,6 +73,7 @@ class BaseCrew(abc.ABC):
             ),
         )
 
+    @functools.cached_property
     def knowledge_base(self) -> QdrantStorage:
         return QdrantStorage(
             type="knowledge-base",
@@ -57,6 +82,10 @@ class BaseCrew(abc.ABC):
             qdrant_api_key=self.qdrant_api_key,
         )
 
+    @functools.cached_property
+    def kb_tool(self) -> QdrantSearchTool:
+        return QdrantSearchTool(self.knowledge_base)
+
 
 @CrewBase
 class KnowledgeOrganizingCrew(BaseCrew):
@@ -107,8 +136,8 @@ class KnowledgeOrganizingCrew(BaseCrew):
             tasks=self.tasks,  # Automatically created by the @task decorator
             process=Process.sequential,
             memory=True,
-            entity_memory=self.entity_memory(),
-            short_term_memory=self.short_term_memory(),
+            entity_memory=self.entity_memory,
+            short_term_memory=self.short_term_memory,
             embedder=self.embedder_config,
             verbose=True,
         )
@@ -134,7 +163,7 @@ class AutoResponderCrew(BaseCrew):
         return Agent(
             config=self.agents_config["response_writer"],
             tools=[
-                QdrantSearchTool(self.knowledge_base()),
+                self.kb_tool,
             ],
             verbose=True,
             llm="anthropic/claude-3-5-sonnet-20241022",
@@ -163,8 +192,8 @@ class AutoResponderCrew(BaseCrew):
             tasks=self.tasks,  # Automatically created by the @task decorator
             process=Process.sequential,
             memory=True,
-            entity_memory=self.entity_memory(),
-            short_term_memory=self.short_term_memory(),
+            entity_memory=self.entity_memory,
+            short_term_memory=self.short_term_memory,
             embedder=self.embedder_config,
             verbose=True,
         )
@@ -186,7 +215,7 @@ class NotionQueryCrew(BaseCrew):
         return Agent(
             config=self.agents_config["knowledge_searcher"],
             tools=[
-                QdrantSearchTool(self.knowledge_base()),
+                self.kb_tool,
             ],
             verbose=True,
             llm="anthropic/claude-3-5-sonnet-20241022",
@@ -207,8 +236,8 @@ class NotionQueryCrew(BaseCrew):
             tasks=self.tasks,
             process=Process.sequential,
             memory=True,
-            entity_memory=self.entity_memory(),
-            short_term_memory=self.short_term_memory(),
+            entity_memory=self.entity_memory,
+            short_term_memory=self.short_term_memory,
             embedder=self.embedder_config,
             verbose=True,
         )
@@ -1,23 +1,74 @@
-import base64
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message as EmailMessage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Generator
 
-from bs4 import BeautifulSoup
+import httplib2
+from cachetools import LRUCache
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import Resource, build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 
 from email_assistant.gmail import models
 
+try:
+    # SIMD-accelerated drop-in replacement, noticeably faster on long bodies
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    # Parses in C, installed with the "html" extra
+    from selectolax.parser import HTMLParser
+
+    def _html_to_text(content: str) -> str:
+        return HTMLParser(content).text(separator=" ")
+
+except ImportError:
+    from bs4 import BeautifulSoup
+
+    def _html_to_text(content: str) -> str:
+        return BeautifulSoup(content, "html.parser").get_text()
+
 logger = logging.getLogger(__name__)
 
 
+# Partial response masks, so Gmail only sends the attributes the models declare
+MESSAGE_FIELDS = (
+    "id,threadId,labelIds,snippet,historyId,"
+    "payload(partId,mimeType,filename,headers,body(size,data),parts)"
+)
+THREAD_FIELDS = f"id,snippet,historyId,messages({MESSAGE_FIELDS})"
+THREAD_LIST_FIELDS = "threads/id,nextPageToken"
+HISTORY_LIST_FIELDS = (
+    "history(id,messagesAdded/message(id,threadId,labelIds),"
+    "messagesDeleted/message(id,threadId)),nextPageToken"
+)
+
+
+def _raw_body(response, content):
+    return content
+
+
+@lru_cache(maxsize=256)
+def _parse_content_charset(content_type: str) -> Optional[str]:
+    # The stdlib parser handles the quoting and the RFC 2231 parameters. There are only
+    # a few distinct Content-Type values, so the parsed charsets are cached.
+    headers = EmailMessage()
+    headers["Content-Type"] = content_type
+    return headers.get_content_charset()
+
+
 class GmailServiceAdapter:
     """
     An adapter over the Gmail API service to simplify the interactions with it and
@@ -31,7 +82,16 @@ class GmailServiceAdapter:
         "https://www.googleapis.com/auth/gmail.modify",
     ]
     DEFAULT_CHARSET = "utf-8"
-    CONTENT_TYPE_PREFERRED = ["text/html", "text/plain"]
+    # Already lowercase, to be compared with the lowercase MIME types of the parts
+    CONTENT_TYPE_PREFERRED = ("text/html", "text/plain")
+    # Gmail accepts up to 100 requests in a single batch, but rate limits the
+    # requests of the batches larger than 50
+    MAX_BATCH_SIZE = 50
+    # The failed requests of a batch are retried with an exponential backoff
+    BATCH_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    MAX_BATCH_RETRIES = 5
+    BATCH_RETRY_DELAY_SEC = 1.0
+    MESSAGE_CACHE_SIZE = 1024
 
     def __init__(self, credentials_dir: Path):
         self._credentials_dir = credentials_dir
@@ -39,6 +99,10 @@ class GmailServiceAdapter:
             self._credentials_dir.mkdir(parents=True)
         self._credentials: Optional[Credentials] = None
         self._service: Optional[Resource] = None
+        # Bounded, so a long-running listener does not keep every message it has seen
+        self._message_cache: LRUCache = LRUCache(maxsize=self.MESSAGE_CACHE_SIZE)
+        # The handlers may load the messages from several threads
+        self._message_cache_lock = threading.Lock()
 
     def is_authenticated(self) -> bool:
         """
@@ -79,61 +143,82 @@ class GmailServiceAdapter:
 
     def iter_unread_threads(self) -> Generator[models.Thread, None, None]:
         """
-        Iterate over all the unread threads in the Gmail Inbox.
+        Iterate over all the unread threads in the Gmail Inbox. The next page is
+        loaded in the background, while the threads of the current one are consumed.
         :return: a generator of the unread threads
         """
-        # Iterate over all the pages of the unread threads
-        page_token = None
-        while True:
-            response = (
-                self._service.users()
-                .threads()
-                .list(userId="me", q="is:unread", pageToken=page_token)
-                .execute()
-            )
-            for thread_descriptor in response.get("threads", []):
-                full_thread = self.load_full_thread(thread_descriptor["id"])
-                yield full_thread
-            page_token = response.get("nextPageToken")
-            if not page_token:
-                break
+        # The HTTP client is not thread-safe, so the background thread gets its own
+        http = self._create_http()
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="gmail-prefetch"
+        ) as executor:
+            future = executor.submit(self._load_unread_threads_page, None, http)
+            while future is not None:
+                threads, page_token = future.result()
+                future = None
+                if page_token:
+                    future = executor.submit(
+                        self._load_unread_threads_page, page_token, http
+                    )
+                yield from threads
 
     def iter_history(
         self, last_history_id: int
     ) -> Generator[models.History, None, None]:
         """
         Iterate over the history of the Gmail Inbox starting from the given history ID.
+        The next page is loaded in the background, while the current one is consumed.
         :param last_history_id: the history ID to start from
         :return: a generator of the history objects
         """
-        # Iterate over all the pages of the history
-        page_token = None
-        while True:
-            try:
-                response = (
-                    self._service.users()
-                    .history()
-                    .list(
-                        userId="me",
-                        startHistoryId=str(last_history_id),
-                        pageToken=page_token,
-                        historyTypes=["messageAdded", "messageDeleted"],
+        # The HTTP client is not thread-safe, so the background thread gets its own
+        http = self._create_http()
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="gmail-prefetch"
+        ) as executor:
+            page_token = None
+            future = executor.submit(
+                self._load_history_page, last_history_id, page_token, http
+            )
+            while True:
+                try:
+                    histories, next_page_token = future.result()
+                except TimeoutError:
+                    logger.error("Timeout error occurred. Retrying...")
+                    future = executor.submit(
+                        self._load_history_page, last_history_id, page_token, http
                     )
-                    .execute()
-                )
-                for history_descriptor in response.get("history", []):
-                    full_history = self._load_full_history(history_descriptor)
-                    yield full_history
-                page_token = response.get("nextPageToken")
+                    continue
+                except HttpError as e:
+                    logger.error("HTTP error occurred: %s", e)
+                    return
+
+                page_token = next_page_token
+                if page_token:
+                    future = executor.submit(
+                        self._load_history_page, last_history_id, page_token, http
+                    )
+                yield from histories
                 if not page_token:
                     logger.info("No more pages to load.")
                     break
-            except TimeoutError:
-                logger.error("Timeout error occurred. Retrying...")
-                continue
-            except HttpError as e:
-                logger.error("HTTP error occurred: %s", e)
-                return
+
+    def watch(self, topic_name: str, label_ids: Optional[list[str]] = None) -> dict:
+        """
+        Ask Gmail to publish the changes of the mailbox to a Cloud Pub/Sub topic.
+        The watch expires after 7 days, so it has to be renewed periodically.
+        :param topic_name: the full name of the topic, like projects/<project>/topics/<topic>
+        :param label_ids: the labels to watch, the Inbox by default
+        :return: the response with the current history ID and the expiration
+        """
+        return (
+            self._service.users()
+            .watch(
+                userId="me",
+                body={"topicName": topic_name, "labelIds": label_ids or ["INBOX"]},
+            )
+            .execute()
+        )
 
     def load_max_history_id(self) -> Optional[int]:
         """
@@ -142,13 +227,19 @@ class GmailServiceAdapter:
         :return: the maximum history ID
         """
         messages = (
-            self._service.users().messages().list(userId="me", maxResults=1).execute()
+            self._service.users()
+            .messages()
+            .list(userId="me", maxResults=1, fields="messages/id")
+            .execute()
         )
         if not messages.get("messages", []):
             return None
         message_id = messages["messages"][0]["id"]
         last_message = (
-            self._service.users().messages().get(userId="me", id=message_id).execute()
+            self._service.users()
+            .messages()
+            .get(userId="me", id=message_id, format="minimal", fields="historyId")
+            .execute()
         )
         return int(last_message["historyId"])
 
@@ -158,28 +249,32 @@ class GmailServiceAdapter:
         :param thread_id: the ID of the thread to load
         :return: the full thread object
         """
-        full_thread = (
+        full_thread = self._raw_json(
             self._service.users()
             .threads()
-            .get(userId="me", id=thread_id, format="full")
-            .execute()
-        )
-        return models.Thread(**full_thread)
+            .get(userId="me", id=thread_id, format="full", fields=THREAD_FIELDS)
+        ).execute()
+        return models.Thread.model_validate_json(full_thread)
 
-    @lru_cache
     def load_full_message(self, message_id: str) -> models.Message:
         """
-        Load the full message from the Gmail service.
+        Load the full message from the Gmail service. The recently loaded messages
+        are served from the cache.
         :param message_id: the ID of the message to load
         :return: the full message object
         """
-        full_message = (
-            self._service.users()
-            .messages()
-            .get(userId="me", id=message_id, format="full")
-            .execute()
-        )
-        return models.Message(**full_message)
+        with self._message_cache_lock:
+            message = self._message_cache.get(message_id)
+        if message is None:
+            full_message = self._raw_json(
+                self._service.users()
+                .messages()
+                .get(userId="me", id=message_id, format="full", fields=MESSAGE_FIELDS)
+            ).execute()
+            message = models.Message.model_validate_json(full_message)
+            with self._message_cache_lock:
+                self._message_cache[message_id] = message
+        return message
 
     def decode_message(self, message: models.Message) -> models.DecodedMessage:
         """
@@ -202,7 +297,7 @@ class GmailServiceAdapter:
         last_message = thread.messages[-1]
 
         # Remove HTML to create a plain text version
-        plain_content = BeautifulSoup(content, "html.parser").get_text()
+        plain_content = _html_to_text(content)
 
         # Build the email message
         email_message = MIMEMultipart("alternative")
@@ -247,40 +342,27 @@ class GmailServiceAdapter:
         """
         content: Optional[str] = None
         charset: str = self.DEFAULT_CHARSET
-        for mime_type in self.CONTENT_TYPE_PREFERRED:
-            # Convert to lowercase for comparison
-            mime_type = mime_type.lower()
-
-            # If the body has data, use it
-            if (
-                message.payload.mime_type.lower() == mime_type
-                and message.payload.body.data
-            ):
-                content = message.payload.body.data
-                charset = self._extract_content_charset(message.payload)
-                logger.debug(f"Found {mime_type} body with charset {charset}")
-                break
 
-            # Some messages have no parts, so we need to check if the parts exist
-            if not message.payload.parts:
-                continue
+        # Flatten the parts once and index the first part with data by its MIME type.
+        # The payload comes first, so its body takes precedence over the inner parts.
+        parts_by_mime_type: dict[str, models.MessagePart] = {}
+        for part in self._flatten_message_parts(message):
+            if part.body.data:
+                parts_by_mime_type.setdefault(part.mime_type.lower(), part)
 
-            # If the body has no data, check the parts, but first flatten the list of parts
-            flatten_parts = self._flatten_message_parts(message)
-            for part in flatten_parts:
-                if not part.mime_type.lower() == mime_type:
-                    continue
+        for mime_type in self.CONTENT_TYPE_PREFERRED:
+            part = parts_by_mime_type.get(mime_type)
+            if part is not None:
                 content = part.body.data
                 charset = self._extract_content_charset(part)
                 logger.debug(
-                    f"Found {mime_type} part with charset {charset} in part {part.part_id}"
+                    "Found %s part with charset %s in part %s",
+                    mime_type,
+                    charset,
+                    part.part_id,
                 )
                 break
 
-            # If content found, break the loop
-            if content:
-                break
-
         # If no text body found, raise an error
         if content is None:
             raise ValueError("No text body found.")
@@ -293,70 +375,164 @@ class GmailServiceAdapter:
             # Fallback to default if the charset is not found
             return base64_decoded.decode(self.DEFAULT_CHARSET)
 
-    def _load_full_history(self, history_descriptor: dict) -> models.History:
+    def _load_unread_threads_page(
+        self, page_token: Optional[str], http=None
+    ) -> tuple[list[models.Thread], Optional[str]]:
         """
-        Parse the history descriptor and load the full history object out of it.
-        :param history_descriptor:
-        :return:
+        Load a page of the unread threads, along with their full content.
+        :param page_token: the token of the page to load, None for the first one
+        :param http: the HTTP client to use, the one of the service by default
+        :return: the full threads and the token of the next page
         """
-        if "messagesAdded" in history_descriptor:
-            messages_added = []
-            for message_added in history_descriptor["messagesAdded"]:
-                try:
-                    message = self.load_full_message(message_added["message"]["id"])
-                    messages_added.append(models.MessageAdded(message=message))
-                except Exception:  # noqa
-                    logger.error("Failed to load the full message: %s", message_added)
-            history_descriptor["messagesAdded"] = messages_added
-        full_history = models.History(**history_descriptor)
-        return full_history
+        response = (
+            self._service.users()
+            .threads()
+            .list(
+                userId="me",
+                q="is:unread",
+                pageToken=page_token,
+                fields=THREAD_LIST_FIELDS,
+            )
+            .execute(http=http)
+        )
+        # Load all the threads of the page in batches, instead of one by one
+        thread_requests = [
+            self._raw_json(
+                self._service.users()
+                .threads()
+                .get(
+                    userId="me",
+                    id=thread_descriptor["id"],
+                    format="full",
+                    fields=THREAD_FIELDS,
+                )
+            )
+            for thread_descriptor in response.get("threads", [])
+        ]
+        threads = [
+            models.Thread.model_validate_json(full_thread)
+            for full_thread in self._execute_batch(thread_requests, http)
+        ]
+        return threads, response.get("nextPageToken")
+
+    def _load_history_page(
+        self, last_history_id: int, page_token: Optional[str], http=None
+    ) -> tuple[list[models.History], Optional[str]]:
+        """
+        Load a page of the history. The added messages are taken from the history
+        records as they are, without their payload, see load_full_message.
+        :param last_history_id: the history ID to start from
+        :param page_token: the token of the page to load, None for the first one
+        :param http: the HTTP client to use, the one of the service by default
+        :return: the history objects and the token of the next page
+        """
+        response = (
+            self._service.users()
+            .history()
+            .list(
+                userId="me",
+                startHistoryId=str(last_history_id),
+                pageToken=page_token,
+                historyTypes=["messageAdded", "messageDeleted"],
+                fields=HISTORY_LIST_FIELDS,
+            )
+            .execute(http=http)
+        )
+        histories = [
+            models.History.model_validate(history_descriptor)
+            for history_descriptor in response.get("history", [])
+        ]
+        return histories, response.get("nextPageToken")
+
+    def _create_http(self) -> AuthorizedHttp:
+        """
+        Create a new authorized HTTP client, for the requests sent from another thread.
+        :return: the HTTP client
+        """
+        return AuthorizedHttp(self._credentials, http=httplib2.Http())
+
+    def _raw_json(self, request: HttpRequest) -> HttpRequest:
+        """
+        Make the request return the raw JSON body instead of the decoded dict, so
+        Pydantic can validate the JSON directly, without building the dicts first.
+        :param request: the request to modify
+        :return: the same request
+        """
+        request.postproc = _raw_body
+        return request
+
+    def _execute_batch(self, requests: list[HttpRequest], http=None) -> list:
+        """
+        Execute the API requests in batches, so up to MAX_BATCH_SIZE requests share
+        a single HTTP round trip. The requests failed with a transient error, such as
+        the rate limit, are retried in the next batches, after an exponential backoff.
+        :param requests: the requests to execute
+        :param http: the HTTP client to use, the one of the service by default
+        :return: the responses in the order of the requests
+        :raises HttpError: if a request failed with a permanent error, or kept failing
+        """
+        responses: list = [None] * len(requests)
+        errors: dict[int, Exception] = {}
+
+        def callback(request_id: str, response, exception: Optional[Exception]):
+            if exception is not None:
+                errors[int(request_id)] = exception
+                return
+            responses[int(request_id)] = response
+
+        pending = list(range(len(requests)))
+        for attempt in range(self.MAX_BATCH_RETRIES + 1):
+            if attempt > 0:
+                delay = self.BATCH_RETRY_DELAY_SEC * 2 ** (attempt - 1)
+                logger.warning(
+                    "Retrying %d failed batched requests in %.1f seconds",
+                    len(pending),
+                    delay,
+                )
+                time.sleep(delay)
+            errors.clear()
+            for start in range(0, len(pending), self.MAX_BATCH_SIZE):
+                batch = self._service.new_batch_http_request(callback=callback)
+                for index in pending[start : start + self.MAX_BATCH_SIZE]:
+                    batch.add(requests[index], request_id=str(index))
+                batch.execute(http=http)
+            if not errors:
+                return responses
+            for exception in errors.values():
+                status = getattr(getattr(exception, "resp", None), "status", None)
+                if status not in self.BATCH_RETRY_STATUSES:
+                    raise exception
+            pending = sorted(errors)
+        raise next(iter(errors.values()))
 
     def _flatten_message_parts(
         self, message: models.Message
     ) -> list[models.MessagePart]:
         """
-        Flatten the list of message parts into a single list.
+        Flatten the tree of message parts into a single list, in depth-first order.
+        An explicit stack is used, so deeply nested messages do not hit the recursion limit.
         :param message:
         :return:
         """
-        parts = [message.payload]
-        for part in message.payload.parts or []:
-            parts.extend(self._flatten_parts(part))
-        return parts
-
-    def _flatten_parts(self, part: models.MessagePart) -> list[models.MessagePart]:
-        """
-        Flatten the inner parts of the message part.
-        :param part:
-        :return:
-        """
-        parts = [part]
-        for inner_part in part.parts or []:
-            parts.extend(self._flatten_parts(inner_part))
+        parts = []
+        stack = [message.payload]
+        while stack:
+            part = stack.pop()
+            parts.append(part)
+            if part.parts:
+                # Reversed, so the inner parts are popped in their original order
+                stack.extend(reversed(part.parts))
         return parts
 
-    def _extract_content_charset(self, message: models.Message) -> str:
+    def _extract_content_charset(self, part: models.MessagePart) -> str:
         """
         Extract the charset from the Content-Type header.
-        :param message:
+        :param part:
         :return:
         """
-        content_type_header = next(
-            (
-                header
-                for header in message.headers
-                if header.name.lower() == "content-type"
-            ),
-            None,
-        )
-        if content_type_header:
-            content_type = content_type_header.value
-            charset_index = content_type.find("charset=")
-            charset_index_end = content_type.find(";", charset_index)
-            if charset_index_end == -1:
-                charset_index_end = len(content_type)
-            charset = content_type[charset_index + len("charset=") : charset_index_end]
-            return charset
+        content_type = part.headers_map.get("content-type")
+        if content_type:
+            return _parse_content_charset(content_type) or self.DEFAULT_CHARSET
         return self.DEFAULT_CHARSET
 
     def _parse_email(self, text: str) -> str:
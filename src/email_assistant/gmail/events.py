@@ -28,6 +28,16 @@ class MessageAddedEvent(BaseGmailEvent):
     def message(self) -> models.Message:
         return self._message
 
+    def full_message(self) -> models.Message:
+        """
+        Get the added message along with its payload. The messages coming from
+        the history have no payload, so it is loaded on the first call.
+        :return: the full message
+        """
+        if self._message.payload is None:
+            self._message = self._gmail_service.load_full_message(self._message.id)
+        return self._message
+
 
 class MessageDeletedEvent(BaseGmailEvent):
     """
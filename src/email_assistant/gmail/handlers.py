@@ -1,12 +1,12 @@
 import abc
 import logging
+import threading
 from typing import Optional
 
-from markdownify import markdownify
+from markdownify import MarkdownConverter
 
 from email_assistant.gmail import events
 from email_assistant import models
-from email_assistant.crew import AutoResponderCrew
 
 logger = logging.getLogger(__name__)
 
@@ -42,9 +42,20 @@ class AgenticAutoReplyHandler(GmailInboxEventHandler):
         qdrant_location: str,
         qdrant_api_key: Optional[str] = None,
     ):
-        self.crew = AutoResponderCrew(
-            embedder_config, qdrant_location, qdrant_api_key
-        ).crew()
+        # CrewAI is heavy to import, so it is only loaded once a handler is created
+        from email_assistant.crew import AutoResponderCrew
+
+        crew_base = AutoResponderCrew(embedder_config, qdrant_location, qdrant_api_key)
+        self.crew = crew_base.crew()
+
+        # Search the frequent queries of the previous runs in the background, so
+        # the first replies find them in the cache
+        threading.Thread(
+            target=crew_base.kb_tool.warm_cache, name="kb-cache-warmer", daemon=True
+        ).start()
+
+        # The converter is reused, so its options are only processed once
+        self._markdown_converter = MarkdownConverter()
 
     def on_message_added(self, event: events.MessageAddedEvent):
         """
@@ -70,11 +81,9 @@ class AgenticAutoReplyHandler(GmailInboxEventHandler):
             return
 
         # Decode the messages and convert them to Markdown
-        decoded_messages = [
-            service.decode_message(message) for message in thread.messages
-        ]
         md_messages = [
-            markdownify(decoded_message.content) for decoded_message in decoded_messages
+            self._markdown_converter.convert(service.decode_message(message).content)
+            for message in thread.messages
         ]
 
         # Call the crew to generate a response
@@ -1,8 +1,10 @@
-import json
 import logging
+import threading
 import time
 from pathlib import Path
 from typing import Optional
+
+import orjson
 from google.oauth2.credentials import Credentials
 from pydantic import BaseModel, Field
 from watchdog.utils import BaseThread
@@ -48,18 +50,20 @@ class GmailInboxState(BaseModel):
         :param path: the path to load the state
         :return: the loaded state
         """
-        with open(path, "r") as f:
-            state_json = json.load(f)
-            return GmailInboxState(**state_json)
+        state_json = orjson.loads(path.read_bytes())
+        return cls(**state_json)
 
     def save(self, path: Path) -> None:
         """
-        Save the current state of the listener to the specified path.
+        Save the current state of the listener to the specified path. The file is
+        replaced atomically, so a crash in the middle of the write does not corrupt
+        the previous state.
         :param path: the path to save the state
         """
-        with open(path, "w") as f:
-            state_json = self.model_dump(mode="json")
-            f.write(json.dumps(state_json))
+        state_json = self.model_dump(mode="json")
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_bytes(orjson.dumps(state_json))
+        tmp_path.replace(path)
 
 
 class GmailInboxListener(BaseThread):
@@ -70,12 +74,16 @@ class GmailInboxListener(BaseThread):
 
     DEFAULT_CHARSET = "utf-8"
     CONTENT_TYPE_PREFERRED = ["text/html", "text/plain"]
+    # Gmail watches expire after 7 days, so they are renewed daily
+    WATCH_RENEWAL_SEC = 24 * 60 * 60
 
     def __init__(
         self,
         credentials_dir: Path,
         state: Optional[GmailInboxState] = None,
         polling_time_sec: int = 1,
+        pubsub_topic: Optional[str] = None,
+        pubsub_subscription: Optional[str] = None,
     ):
         super().__init__()
         self._credentials_dir = credentials_dir
@@ -87,6 +95,13 @@ class GmailInboxListener(BaseThread):
         self._handlers: list[GmailInboxEventHandler] = []
         self._polling_time_sec = polling_time_sec
 
+        # Optional push notifications. Without them, the listener only polls.
+        self._pubsub_topic = pubsub_topic
+        self._pubsub_subscription = pubsub_subscription
+        self._streaming_pull = None
+        self._watch_renewed_at: Optional[float] = None
+        self._wakeup = threading.Event()
+
     def add_handler(self, handler: GmailInboxEventHandler):
         """
         Add a new handler to the listener.
@@ -99,6 +114,15 @@ class GmailInboxListener(BaseThread):
         if not self._service.is_authenticated():
             self._service.authenticate()
 
+        # Subscribe to the push notifications, if configured
+        if self._pubsub_topic and self._pubsub_subscription:
+            self._start_push_notifications()
+
+    def on_thread_stop(self) -> None:
+        if self._streaming_pull is not None:
+            self._streaming_pull.cancel()
+        self._wakeup.set()
+
     def run(self) -> None:
         """
         Start the listener and run the loop that listens for new events in the Gmail Inbox.
@@ -126,6 +150,9 @@ class GmailInboxListener(BaseThread):
             self._state.process_all_unread_threads = False
 
         while True:
+            # Notifications arriving from now on trigger another run of the loop
+            self._wakeup.clear()
+
             # If we still don't have the last history ID, we just extract the last one
             # from the Google Gmail service and sta`rt processing from here
             if self._state.last_history_id is None:
@@ -156,8 +183,59 @@ class GmailInboxListener(BaseThread):
             # Log the number of processed history events
             logger.info("Processed %i history events", counter + 1)
 
-            # Wait for the polling time to not overload the Gmail API
-            time.sleep(self._polling_time_sec)
+            # Wait for a push notification, with the polling time as a fallback
+            self._wakeup.wait(self._polling_time_sec)
+            self._renew_watch()
+
+    def _start_push_notifications(self) -> None:
+        """
+        Make Gmail publish the changes of the Inbox to the Pub/Sub topic and wake
+        the listener up whenever a notification arrives on the subscription.
+        """
+        # Pub/Sub is an optional dependency, only needed for the push notifications
+        try:
+            from google.cloud import pubsub_v1
+        except ImportError:
+            logger.warning(
+                "The push notifications need the google-cloud-pubsub package, "
+                "polling the inbox every %s seconds instead",
+                self._polling_time_sec,
+            )
+            return
+
+        self._service.watch(self._pubsub_topic)
+        self._watch_renewed_at = time.monotonic()
+
+        subscriber = pubsub_v1.SubscriberClient()
+        self._streaming_pull = subscriber.subscribe(
+            self._pubsub_subscription, callback=self._on_push_notification
+        )
+        logger.info(
+            "Listening to the push notifications of %s", self._pubsub_subscription
+        )
+
+    def _on_push_notification(self, message) -> None:
+        """
+        Handle a push notification. The notification only carries the latest history
+        ID, the listener loads the history from its own state.
+        :param message: the Pub/Sub message
+        """
+        message.ack()
+        self._wakeup.set()
+
+    def _renew_watch(self) -> None:
+        """
+        Renew the Gmail watch before it expires, if the push notifications are used.
+        """
+        if self._watch_renewed_at is None:
+            return
+        if time.monotonic() - self._watch_renewed_at < self.WATCH_RENEWAL_SEC:
+            return
+        try:
+            self._service.watch(self._pubsub_topic)
+            self._watch_renewed_at = time.monotonic()
+        except Exception as e:
+            logger.error("Failed to renew the Gmail watch: %s", e)
 
     def state(self) -> GmailInboxState:
         """
@@ -1,79 +1,88 @@
 import logging
+from functools import cached_property
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from pydantic.alias_generators import to_camel
 
 logger = logging.getLogger(__name__)
 
 
-class Header(BaseModel):
+class GmailModel(BaseModel):
+    """
+    A base class for the Gmail API objects. The API uses camelCase attribute names,
+    which are mapped to the snake_case fields by the alias generator.
+    """
+
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+
+class Header(GmailModel):
     name: str
     value: str
 
 
-class MessagePartBody(BaseModel):
-    attachment_id: Optional[str] = Field(default=None, alias="attachmentId")
+class MessagePartBody(GmailModel):
     size: int
     data: Optional[str] = None
 
 
-class MessagePart(BaseModel):
-    part_id: str = Field(alias="partId")
-    mime_type: str = Field(alias="mimeType")
+class MessagePart(GmailModel):
+    part_id: str
+    mime_type: str
     filename: str
     headers: list[Header]
     body: MessagePartBody
     parts: Optional[list["MessagePart"]] = None
 
+    @cached_property
+    def headers_map(self) -> dict[str, str]:
+        """
+        The header values by their lowercase names, built once per part. The first
+        occurrence of a repeated header wins.
+        """
+        return {header.name.lower(): header.value for header in reversed(self.headers)}
+
 
-class Message(BaseModel):
+class Message(GmailModel):
     id: str
-    thread_id: str = Field(alias="threadId")
-    label_ids: Optional[list[str]] = Field(default=None, alias="labelIds")
+    thread_id: str
+    label_ids: Optional[list[str]] = None
     snippet: Optional[str] = None
-    history_id: Optional[str] = Field(default=None, alias="historyId")
-    internal_date: Optional[str] = Field(default=None, alias="internalDate")
+    history_id: Optional[str] = None
     payload: Optional[MessagePart] = None
-    size_estimate: Optional[int] = Field(default=None, alias="sizeEstimate")
-    raw: Optional[str] = None
 
     def __str__(self):
         return f"Message(id={self.id}, thread_id={self.thread_id}, snippet={self.snippet}, ...)"
 
     def get_header_value(self, name: str) -> Optional[str]:
-        for header in self.payload.headers:
-            if header.name.lower() == name.lower():
-                return header.value
-        return None
+        return self.payload.headers_map.get(name.lower())
 
 
-class Thread(BaseModel):
+class Thread(GmailModel):
     id: str
     snippet: Optional[str] = None
-    history_id: str = Field(alias="historyId")
+    history_id: str
     messages: list[Message]
 
 
-class MessageAdded(BaseModel):
+class MessageAdded(GmailModel):
     message: Message
 
 
-class MessageDeleted(BaseModel):
+class MessageDeleted(GmailModel):
     message: Message
 
 
-class History(BaseModel):
+class History(GmailModel):
     id: str
-    messages: list[Message] = Field(default_factory=list)  # noqa
-    messages_added: list[MessageAdded] = Field(  # noqa
-        alias="messagesAdded", default_factory=list
-    )
-    messages_deleted: list[MessageDeleted] = Field(  # noqa
-        alias="messagesDeleted", default_factory=list
-    )
+    # The "messages" key of the history records is not declared, as nothing reads it.
+    # Pydantic ignores the undeclared keys, so those messages are never validated.
+    messages_added: list[MessageAdded] = Field(default_factory=list)  # noqa
+    messages_deleted: list[MessageDeleted] = Field(default_factory=list)  # noqa
 
 
-class DecodedMessage(BaseModel):
+class DecodedMessage(GmailModel):
     message: Message
     content: str
 
@@ -0,0 +1,71 @@
+import logging
+import logging.config
+import time
+
+_DONE = False
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """
+    A formatter calling strftime at most once per second. The records logged within
+    the same second reuse the formatted timestamp and only differ in milliseconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Stored as a single tuple, so concurrent handlers never see a torn update
+        self._cached_time: tuple[int, str] = (-1, "")
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str = None) -> str:
+        second = int(record.created)
+        cached_second, formatted = self._cached_time
+        if second != cached_second:
+            formatted = time.strftime(
+                datefmt or self.default_time_format, self.converter(record.created)
+            )
+            self._cached_time = (second, formatted)
+        if datefmt:
+            return formatted
+        return self.default_msec_format % (formatted, record.msecs)
+
+
+def configure_logging(level: int = logging.DEBUG) -> None:
+    """
+    Configure the logging of the application. Only the first call has an effect,
+    so the entry points and the spawned worker processes can call it safely.
+    :param level: the level of the root logger
+    """
+    global _DONE
+    if _DONE:
+        return
+
+    logging.config.dictConfig(
+        {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "formatters": {
+                "default": {
+                    "()": CachedTimeFormatter,
+                    "fmt": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                },
+            },
+            "handlers": {
+                "console": {
+                    "class": "logging.StreamHandler",
+                    "formatter": "default",
+                },
+            },
+            "root": {
+                "level": level,
+                "handlers": ["console"],
+            },
+            # Reduce noise from AI processing logs
+            "loggers": {
+                "httpx": {"level": logging.WARNING},
+                "httpcore": {"level": logging.WARNING},
+                "litellm": {"level": logging.ERROR},
+                "litellm.cost_calculator": {"level": logging.ERROR},
+            },
+        }
+    )
+    _DONE = True
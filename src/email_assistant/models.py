@@ -1,20 +1,29 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List
 
 
-class EmailThreadCategories(BaseModel):
+class FrozenModel(BaseModel):
+    """
+    A base class for the crew outputs. They are never modified after being parsed,
+    so they are frozen and can be safely shared between the threads and the caches.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+
+class EmailThreadCategories(FrozenModel):
     categories: list[str]
 
 
-class EmailResponse(BaseModel):
+class EmailResponse(FrozenModel):
     content: str = Field(description="HTML content of the email response")
 
 
-class Chunk(BaseModel):
+class Chunk(FrozenModel):
     content: str = Field(description="The content of the chunk")
 
 
-class Chunks(BaseModel):
+class Chunks(FrozenModel):
     chunks: list[Chunk] = Field(
         description="A list of chunks extracted from the document"
     )
@@ -26,13 +35,13 @@ class ContextualizedChunk(Chunk):
     )
 
 
-class ContextualizedChunks(BaseModel):
+class ContextualizedChunks(FrozenModel):
     chunks: list[ContextualizedChunk] = Field(
         description="A list of contextualized chunks extracted from the document"
     )
 
 
-class NotionAnswer(BaseModel):
+class NotionAnswer(FrozenModel):
     """Model for answers to questions about Notion data"""
     answer: str
     sources: List[str] = []  # List of Notion page URLs or titles used as sources
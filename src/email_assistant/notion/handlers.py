@@ -0,0 +1,41 @@
+import logging
+from typing import Optional
+
+import httpx
+from notion_client import Client
+
+logger = logging.getLogger(__name__)
+
+
+class NotionToQdrantHandler:
+    """
+    Synchronizes the Notion pages into the Qdrant knowledge base.
+    """
+
+    __slots__ = ("_http", "notion")
+
+    def __init__(
+        self, notion_api_key, qdrant_location, qdrant_api_key=None, embedder_config=None
+    ):
+        # The handler lives for the whole sync loop, so keep the connections to the
+        # Notion API alive between the cycles instead of redoing the TLS handshake
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=600),
+        )
+        self.notion = Client(auth=notion_api_key, client=self._http)
+        # Initialize Qdrant and other necessary components
+
+    def close(self):
+        """
+        Release the connections held by the handler.
+        """
+        self.notion.close()
+
+    def sync_notion_to_qdrant(self, since: Optional[str] = None) -> Optional[str]:
+        """
+        Sync the Notion pages edited after the given time into Qdrant.
+        :param since: the last_edited_time cursor of the previous sync, None for a full sync
+        :return: the greatest last_edited_time of the synced pages, to be used as the next cursor
+        """
+        # Implement logic to fetch data from Notion and update Qdrant
+        return since
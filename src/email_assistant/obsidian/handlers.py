@@ -1,8 +1,14 @@
+import hashlib
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 import os
 
+import diskcache
 import yaml
 from watchdog.events import (
     FileSystemEventHandler,
@@ -17,20 +23,56 @@ from watchdog.events import (
 )
 
 from email_assistant import models
-from email_assistant.crew import KnowledgeOrganizingCrew
-from notion_client import Client
 
 logger = logging.getLogger(__name__)
 
+# Use the libyaml bindings, if PyYAML was built with them
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_FRONTMATTER_DELIMITER = "---"
 
-class NotionToQdrantHandler:
-    def __init__(self, notion_api_key, qdrant_location, qdrant_api_key=None):
-        self.notion = Client(auth=notion_api_key)
-        # Initialize Qdrant and other necessary components
+# The actions queued for the worker thread
+_PROCESS = "process"
+_DELETE = "delete"
 
-    def sync_notion_to_qdrant(self):
-        # Implement logic to fetch data from Notion and update Qdrant
-        pass
+CREW_CACHE_DIR = Path.home() / ".cache" / "email_assistant" / "crew_cache"
+
+
+def _crew_fingerprint(crew_config_dir: Path, config_paths, crew) -> bytes:
+    """
+    Fingerprint the definition of a crew, so its cached results are not reused once
+    the prompts or the models change.
+    :param crew_config_dir: the directory the config paths are relative to
+    :param config_paths: the paths of the agents and tasks YAML configs of the crew
+    :param crew: the built crew, whose agents' models are included
+    :return: the fingerprint
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for config_path in config_paths:
+        digest.update((crew_config_dir / config_path).read_bytes())
+    for agent in crew.agents:
+        digest.update(str(getattr(agent.llm, "model", agent.llm)).encode())
+    return digest.digest()
+
+
+def _parse_frontmatter(file_content: str) -> dict:
+    """
+    Parse the YAML frontmatter at the top of a Markdown file. Only the frontmatter
+    block is parsed, not the whole note.
+    :param file_content: the content of the Markdown file
+    :return: the frontmatter, empty if the file has none
+    """
+    first_line, _, rest = file_content.partition("\n")
+    if first_line.rstrip() != _FRONTMATTER_DELIMITER:
+        return {}
+    # The block ends with the next delimiter line, prepend a newline for an empty block
+    end = f"\n{rest}".find(f"\n{_FRONTMATTER_DELIMITER}")
+    if end == -1:
+        return {}
+    try:
+        frontmatter = yaml.load(rest[:end], Loader=_YAML_LOADER)
+    except yaml.YAMLError:
+        return {}
+    return frontmatter if isinstance(frontmatter, dict) else {}
 
 
 class AgenticObsidianVaultToQdrantHandler(FileSystemEventHandler):
@@ -45,26 +87,87 @@ class AgenticObsidianVaultToQdrantHandler(FileSystemEventHandler):
         qdrant_location: str,
         qdrant_api_key: Optional[str] = None,
         min_content_length: int = 10,
+        debounce_sec: float = 2.0,
+        crew_cache_dir: Optional[Path] = None,
     ):
+        # CrewAI is heavy to import, so it is only loaded once a handler is created
+        from email_assistant import crew as crew_module
+        from email_assistant.crew import KnowledgeOrganizingCrew
+
         crew = KnowledgeOrganizingCrew(embedder_config, qdrant_location, qdrant_api_key)
         self.crew = crew.crew()
-        self.knowledge_base = crew.knowledge_base()
+        self.knowledge_base = crew.knowledge_base
         self.min_content_length = min_content_length
 
-    def initialize(self, init_path: Path):
+        # Editors save a note many times in a row, so the events of a file are only
+        # processed once it has been quiet for the debounce time
+        self.debounce_sec = debounce_sec
+
+        # Hashes of the stored contents, to skip the crew for no-op modifications
+        self._content_hashes: dict[str, bytes] = {}
+
+        # The chunks extracted by the crew, by the path and the hash of the content.
+        # It survives the restarts, so the crew only runs for the contents it has not
+        # seen yet. The keys include the fingerprint of the crew definition, so a
+        # change of the prompts or the models runs the crew again.
+        self._crew_cache = diskcache.Cache(str(crew_cache_dir or CREW_CACHE_DIR))
+        # The config paths are class attributes, the instance holds the loaded configs
+        self._crew_fingerprint = _crew_fingerprint(
+            Path(crew_module.__file__).parent,
+            [
+                KnowledgeOrganizingCrew.agents_config,
+                KnowledgeOrganizingCrew.tasks_config,
+            ],
+            self.crew,
+        )
+
+        # The observer thread only queues the events, the slow crew runs happen on
+        # a worker thread, so no filesystem event waits behind them
+        self._event_queue: queue.Queue[tuple[str, str]] = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run_worker, name="obsidian-worker", daemon=True
+        )
+        self._worker.start()
+
+    def initialize(self, init_path: Path, max_workers: int = 16):
         """
-        Initialize the Qdrant collection with existing files.
+        Initialize the Qdrant collection with existing files. The files missing from the
+        knowledge base are loaded in parallel.
+        :param init_path: the root directory of the vault
+        :param max_workers: the number of files processed at the same time
         """
+        # Load the stored paths once, instead of counting the points of every file
+        stored_paths = self.knowledge_base.get_all_src_paths()
+        missing_paths = []
         for file_path in Path(init_path).rglob("*.md"):
             file_path_str = str(file_path)
-            points_count = self.knowledge_base.count({"src_path": file_path_str})
-            if points_count > 0:
+            if file_path_str in stored_paths:
                 logger.info("File already exists in the knowledge base: %s", file_path)
                 continue
+            missing_paths.append(file_path_str)
+
+        # A crew keeps the state of its current run, so each worker needs its own copy
+        local = threading.local()
+
+        def load_file(file_path_str: str) -> None:
+            crew = getattr(local, "crew", None)
+            if crew is None:
+                crew = local.crew = self.crew.copy()
+            logger.info("Loading file into the knowledge base: %s", file_path_str)
+            try:
+                self._process_file(file_path_str, replace=False, crew=crew)
+            except Exception as e:
+                logger.error("Error while loading the file %s: %s", file_path_str, e)
+
+        if not missing_paths:
+            return
 
-            self.on_created(
-                FileCreatedEvent(file_path_str, file_path_str, is_synthetic=True)
-            )
+        # Build the vector index once, after all the files are loaded
+        with self.knowledge_base.deferred_indexing(), ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="obsidian-init"
+        ) as executor:
+            # Consume the results, so the pool is drained before returning
+            list(executor.map(load_file, missing_paths))
 
     def on_created(self, event: DirCreatedEvent | FileCreatedEvent) -> None:
         """
@@ -82,45 +185,7 @@ class AgenticObsidianVaultToQdrantHandler(FileSystemEventHandler):
         # Log the event
         logger.info("New file created: %s", event.src_path)
 
-        # Load the file content
-        file_content = Path(event.src_path).read_text().strip()
-
-        # Only process the file if the content is longer than the minimum length
-        if len(file_content) < self.min_content_length:
-            logger.info(
-                "The file content is shorter than the minimum length of %i: %s",
-                self.min_content_length,
-                event.src_path,
-            )
-            return
-
-        # Load the frontmatter from the Markdown file
-        try:
-            frontmatter = next(yaml.safe_load_all(file_content))
-            if not isinstance(frontmatter, dict):
-                frontmatter = {}
-        except StopIteration:
-            frontmatter = {}
-
-        # Run the knowledge organizing crew to store the file content in the knowledge base
-        response = self.crew.kickoff(
-            inputs={"src_path": event.src_path, "document": file_content}
-        )
-        if not isinstance(response.pydantic, models.ContextualizedChunks):
-            logger.info("Did not receive any contextualized chunks: %s", response)
-            return
-
-        # Store the response in the Qdrant knowledge base
-        document_chunks: models.ContextualizedChunks = response.pydantic  # noqa
-        for chunk in document_chunks.chunks:
-            formatted_input_data = f"{chunk.content}\n\n{chunk.context}"
-            metadata = {
-                "src_path": event.src_path,
-                "chunk_context": chunk.context,
-                "chunk_content": chunk.content,
-                **frontmatter,
-            }
-            self.knowledge_base.save(formatted_input_data, metadata)
+        self._event_queue.put((_PROCESS, event.src_path))
 
     def on_deleted(self, event: DirDeletedEvent | FileDeletedEvent) -> None:
         """
@@ -140,8 +205,7 @@ class AgenticObsidianVaultToQdrantHandler(FileSystemEventHandler):
         # Log the event
         logger.info("File deleted: %s", event.src_path)
 
-        # Remove all the entries related to the file from the knowledge base
-        self.knowledge_base.delete({"src_path": event.src_path})
+        self._event_queue.put((_DELETE, event.src_path))
 
     def on_modified(self, event: DirModifiedEvent | FileModifiedEvent) -> None:
         """
@@ -161,15 +225,7 @@ class AgenticObsidianVaultToQdrantHandler(FileSystemEventHandler):
         # Log the event
         logger.info("File modified: %s", event.src_path)
 
-        # Remove the existing content
-        self.on_deleted(
-            FileDeletedEvent(event.src_path, event.dest_path, is_synthetic=True)
-        )
-
-        # Load the new content
-        self.on_created(
-            FileCreatedEvent(event.src_path, event.dest_path, is_synthetic=True)
-        )
+        self._event_queue.put((_PROCESS, event.src_path))
 
     def on_moved(self, event: DirMovedEvent | FileMovedEvent) -> None:
         """
@@ -196,3 +252,145 @@ class AgenticObsidianVaultToQdrantHandler(FileSystemEventHandler):
         self.on_created(
             FileCreatedEvent(event.dest_path, event.dest_path, is_synthetic=True)
         )
+
+    def _run_worker(self) -> None:
+        """
+        Process the queued events, in their order. The files are processed once they
+        have been quiet for the debounce time, so a burst of events is handled once.
+        """
+        # The deadlines of the files waiting to be processed
+        due: dict[str, float] = {}
+        while True:
+            timeout = None
+            if due:
+                timeout = max(0.0, min(due.values()) - time.monotonic())
+            try:
+                action, src_path = self._event_queue.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                if action == _PROCESS:
+                    due[src_path] = time.monotonic() + self.debounce_sec
+                elif action == _DELETE:
+                    # Drop the pending processing, the file is gone anyway
+                    due.pop(src_path, None)
+                    self._run_safely(self._delete_file, src_path)
+
+            now = time.monotonic()
+            for src_path in [path for path, deadline in due.items() if deadline <= now]:
+                del due[src_path]
+                self._run_safely(self._process_file, src_path)
+
+    def _run_safely(self, func, src_path: str) -> None:
+        try:
+            func(src_path)
+        except Exception as e:
+            logger.error("Error while processing the file %s: %s", src_path, e)
+            logger.exception(e)
+
+    def _delete_file(self, src_path: str) -> None:
+        """
+        Remove all the entries related to the file from the knowledge base.
+        :param src_path: the path of the Markdown file
+        """
+        self._content_hashes.pop(src_path, None)
+        self.knowledge_base.delete({"src_path": src_path})
+
+    def _process_file(self, src_path: str, replace: bool = True, crew=None) -> None:
+        """
+        Load the file content into the knowledge base, unless it did not change since
+        it was stored last time.
+        :param src_path: the path of the Markdown file
+        :param replace: remove the existing content of the file, in the same request
+        :param crew: the crew to run, the one of the handler by default
+        """
+        try:
+            file_content = Path(src_path).read_text().strip()
+        except FileNotFoundError:
+            logger.info("The file no longer exists: %s", src_path)
+            return
+
+        content_hash = hashlib.blake2b(file_content.encode(), digest_size=16).digest()
+        if self._content_hashes.get(src_path) == content_hash:
+            logger.info("The file content did not change: %s", src_path)
+            return
+
+        # Only process the file if the content is longer than the minimum length
+        if len(file_content) < self.min_content_length:
+            logger.info(
+                "The file content is shorter than the minimum length of %i: %s",
+                self.min_content_length,
+                src_path,
+            )
+            if replace:
+                self.knowledge_base.delete({"src_path": src_path})
+            self._content_hashes[src_path] = content_hash
+            return
+
+        chunks = self._build_chunks(
+            src_path, file_content, content_hash, crew or self.crew
+        )
+        if chunks is None:
+            # The crew failed, possibly transiently, so the stored content is kept
+            # and the hash is not recorded, so the next event of the file retries
+            return
+
+        formatted_input_data, metadatas = chunks
+        if replace:
+            # Replace the existing content with the new one in a single request,
+            # so the file does not disappear from the knowledge base in the meantime
+            self.knowledge_base.replace_by_filter(
+                {"src_path": src_path}, formatted_input_data, metadatas
+            )
+        else:
+            # All the chunks are embedded and stored in a single round trip
+            self.knowledge_base.save_many(formatted_input_data, metadatas)
+        self._content_hashes[src_path] = content_hash
+
+    def _build_chunks(
+        self, src_path: str, file_content: str, content_hash: bytes, crew
+    ) -> Optional[tuple[list[str], list[dict]]]:
+        """
+        Run the knowledge organizing crew over the file and build the chunks to store.
+        :param src_path: the path of the Markdown file
+        :param file_content: the content of the file
+        :param content_hash: the hash of the content, part of the key of the crew cache
+        :param crew: the knowledge organizing crew to run
+        :return: the formatted chunks and their metadata, None if the crew failed
+        """
+        # Load the frontmatter from the Markdown file
+        frontmatter = _parse_frontmatter(file_content)
+
+        cache_key = hashlib.blake2b(
+            self._crew_fingerprint + src_path.encode() + content_hash, digest_size=16
+        ).digest()
+        cached_chunks = self._crew_cache.get(cache_key)
+        if cached_chunks is not None:
+            logger.info("Reusing the chunks of the same content: %s", src_path)
+            document_chunks = models.ContextualizedChunks.model_validate_json(
+                cached_chunks
+            )
+        else:
+            # Run the knowledge organizing crew to store the file content in the knowledge base
+            response = crew.kickoff(
+                inputs={"src_path": src_path, "document": file_content}
+            )
+            if not isinstance(response.pydantic, models.ContextualizedChunks):
+                logger.info("Did not receive any contextualized chunks: %s", response)
+                return None
+
+            document_chunks: models.ContextualizedChunks = response.pydantic  # noqa
+            self._crew_cache.set(cache_key, document_chunks.model_dump_json())
+        contents = [chunk.content for chunk in document_chunks.chunks]
+        contexts = [chunk.context for chunk in document_chunks.chunks]
+        formatted_input_data = list(map("\n\n".join, zip(contents, contexts)))
+        metadatas = [
+            {
+                "src_path": src_path,
+                "chunk_context": context,
+                "chunk_content": content,
+                **frontmatter,
+            }
+            for content, context in zip(contents, contexts)
+        ]
+        return formatted_input_data, metadatas
@@ -1,13 +1,124 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import os
+import threading
 import uuid
 import logging
-from typing import Optional, List, Any, Dict
+import weakref
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Optional, List, Any, Dict, Iterable, Sequence, Union
 
 from crewai.memory.storage.rag_storage import RAGStorage
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 from chromadb.utils import embedding_functions
 
 logger = logging.getLogger(__name__)
 
+# Namespace of the point IDs, see QdrantStorage._point_id
+POINT_ID_NAMESPACE = uuid.UUID("da23df68-8243-4da9-9755-9bb753e171e0")
+
+# The size of the batches of the large uploads, see QdrantStorage.save_many
+UPLOAD_BATCH_SIZE = int(os.environ.get("QDRANT_UPLOAD_BATCH_SIZE", 64))
+
+# The clients talk to Qdrant over gRPC, unless QDRANT_PREFER_GRPC is set to false
+QDRANT_PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "true").lower() != "false"
+QDRANT_GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", 6334))
+
+# Coalescing of the concurrent async searches, see QdrantStorage._run_query_batcher
+QUERY_BATCH_SIZE = int(os.environ.get("QDRANT_QUERY_BATCH_SIZE", 64))
+QUERY_BATCH_WAIT_SEC = float(os.environ.get("QDRANT_QUERY_BATCH_WAIT_SEC", 0.005))
+# Too many concurrent requests make Qdrant slower overall, see _send_query_batch
+QUERY_MAX_INFLIGHT = int(os.environ.get("QDRANT_MAX_INFLIGHT", 16))
+
+# Caches of the search results by server and collection, see QdrantStorage.add_cache.
+# The storages of the same collection share them, as any of them may change it.
+_SEARCH_CACHES: Dict[tuple, weakref.WeakSet] = defaultdict(weakref.WeakSet)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client(location: str, api_key: Optional[str] = None) -> QdrantClient:
+    """
+    Get the Qdrant client of the given server. The client is shared by all the storages
+    of the process, so they reuse the same connection pool.
+    :param location: the URL of the Qdrant server
+    :param api_key: the API key of the Qdrant server
+    :return: the client
+    """
+    return QdrantClient(
+        location,
+        api_key=api_key,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+        grpc_port=QDRANT_GRPC_PORT,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _search_params(hnsw_ef: int) -> models.SearchParams:
+    """
+    Build the parameters of the searches. The quantized vectors are searched first,
+    oversampled, and the candidates are rescored with the original vectors.
+    :param hnsw_ef: the size of the HNSW candidate list, the higher the more accurate
+    :return: the search parameters
+    """
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef,
+        quantization=models.QuantizationSearchParams(
+            ignore=False, rescore=True, oversampling=2.0
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _payload_selector(
+    fields: Optional[tuple],
+) -> Union[bool, models.PayloadSelectorInclude]:
+    """
+    Build the selector of the payload fields returned by the searches.
+    :param fields: the payload fields to return, like "metadata.src_path", or None
+                   to return the whole payload
+    :return: the payload selector
+    """
+    if fields is None:
+        return True
+    return models.PayloadSelectorInclude(include=list(fields))
+
+
+@functools.lru_cache(maxsize=256, typed=True)
+def _field_condition(key: str, value: Any) -> models.FieldCondition:
+    """
+    Build the exact match condition on the metadata key. The same few conditions, like
+    the path of a file, are used over and over again, so they are cached. The cache
+    is typed, as 1 and True are equal but need different match values.
+    :param key: the metadata key
+    :param value: the expected value
+    :return: the condition
+    """
+    return models.FieldCondition(
+        key=f"metadata.{key}",
+        match=models.MatchValue(value=value),
+    )
+
+
+class _LoopState:
+    """
+    The async search machinery of a storage in a single event loop. The queue, the
+    tasks and the connections of the async client all belong to the loop they were
+    created in, so every loop gets its own.
+    """
+
+    def __init__(self, client: AsyncQdrantClient):
+        self.client = client
+        self.queue = asyncio.Queue()
+        # The event loop only keeps weak references to the tasks
+        self.tasks = set()
+        self.batcher: Optional[asyncio.Task] = None
+        # Bounds the batches sent at the same time, see _send_query_batch
+        self.inflight = asyncio.Semaphore(QUERY_MAX_INFLIGHT)
+
+
 class QdrantStorage(RAGStorage):
     """
     Extends Storage to handle embeddings for memory entries using Qdrant.
@@ -15,6 +126,30 @@ class QdrantStorage(RAGStorage):
 
     TEST_STRING = "test"
     MAX_LENGTH_BYTES = 8192
+    DEFAULT_INDEXING_THRESHOLD = 20000
+    # Keeps the p95 latency under 100ms up to about a million points
+    DEFAULT_HNSW_EF = 64
+
+    # The quantized vectors are kept in RAM, the original ones on disk for rescoring
+    QUANTIZATION_CONFIG = models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, always_ram=True
+        )
+    )
+
+    # The filters are built on the metadata, see _to_qdrant_filter
+    PAYLOAD_INDEXES = {
+        "metadata.src_path": models.KeywordIndexParams(
+            type=models.KeywordIndexType.KEYWORD
+        ),
+        # Most of the Notion queries are scoped to a single page
+        "metadata.notion_page_id": models.KeywordIndexParams(
+            type=models.KeywordIndexType.KEYWORD, is_tenant=True
+        ),
+        "metadata.last_edited_time": models.DatetimeIndexParams(
+            type=models.DatetimeIndexType.DATETIME
+        ),
+    }
 
     app: QdrantClient | None = None
 
@@ -30,6 +165,9 @@ class QdrantStorage(RAGStorage):
         self._qdrant_location = qdrant_location or "http://localhost:6333"
         self._qdrant_api_key = qdrant_api_key
         self.type = type
+        # Created on the first async search of each event loop, see _get_loop_state
+        self._loop_states: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
+        self._loop_states_lock = threading.Lock()
         super().__init__(type, allow_reset, embedder_config, crew)
 
     def search(
@@ -38,33 +176,246 @@ class QdrantStorage(RAGStorage):
         limit: int = 3,
         filter: Optional[dict] = None,
         score_threshold: float = 0,
+        hnsw_ef: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None,
     ) -> list[dict]:
+        return self.search_vec(
+            self.embed(query), limit, filter, score_threshold, hnsw_ef, fields
+        )
+
+    def embed(self, text: str) -> List[float]:
+        """
+        Embed a single text, the same way the stored values and queries are embedded.
+        :param text: the text to embed
+        :return: the embedding
+        """
         # Limit the text length to avoid the document being too large for the model
-        query = self._normalize_text(query)
+        return self.embedder_config([self._normalize_text(text)])[0]
 
-        # Embed the text and search for similar points
-        embedding = self.embedder_config([query])[0]
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several texts with a single call to the embedder, see embed.
+        :param texts: the texts to embed
+        :return: the embeddings, in the same order
+        """
+        return self.embedder_config([self._normalize_text(text) for text in texts])
+
+    def search_vec(
+        self,
+        embedding: List[float],
+        limit: int = 3,
+        filter: Optional[dict] = None,
+        score_threshold: float = 0,
+        hnsw_ef: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> list[dict]:
+        """
+        Search for the points similar to an already computed query embedding.
+        :param embedding: the embedding of the query, see embed
+        :param limit: the number of results to return
+        :param filter: the exact match filter on the metadata
+        :param score_threshold: the minimal score of the results
+        :param hnsw_ef: the size of the HNSW candidate list, DEFAULT_HNSW_EF by default
+        :param fields: the payload fields to return, like "value" or
+                       "metadata.src_path", the whole payload by default
+        :return: the results, with their ID, metadata, context and score
+        """
         response = self.app.query_points(
             self.type,
             query=embedding,
             query_filter=self._to_qdrant_filter(filter),
+            search_params=_search_params(hnsw_ef or self.DEFAULT_HNSW_EF),
             limit=limit,
             score_threshold=score_threshold,
+            with_payload=_payload_selector(tuple(fields) if fields else None),
+            with_vectors=False,
         )
-        results = [
+        return self._to_results(response.points)
+
+    async def asearch(
+        self,
+        query: str,
+        limit: int = 3,
+        filter: Optional[dict] = None,
+        score_threshold: float = 0,
+        hnsw_ef: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> list[dict]:
+        """
+        Search without blocking the event loop, see search.
+        """
+        # The embedder is synchronous, so it runs in a worker thread
+        embedding = await asyncio.to_thread(self.embed, query)
+        return await self.asearch_vec(
+            embedding, limit, filter, score_threshold, hnsw_ef, fields
+        )
+
+    async def asearch_vec(
+        self,
+        embedding: List[float],
+        limit: int = 3,
+        filter: Optional[dict] = None,
+        score_threshold: float = 0,
+        hnsw_ef: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> list[dict]:
+        """
+        Search without blocking the event loop, see search_vec. The searches issued
+        concurrently are sent to Qdrant in batches.
+        """
+        request = models.QueryRequest(
+            query=embedding,
+            filter=self._to_qdrant_filter(filter),
+            params=_search_params(hnsw_ef or self.DEFAULT_HNSW_EF),
+            limit=limit,
+            score_threshold=score_threshold,
+            with_payload=_payload_selector(tuple(fields) if fields else None),
+            with_vector=False,
+        )
+        future = asyncio.get_running_loop().create_future()
+        await self._get_loop_state().queue.put((request, future))
+        return self._to_results(await future)
+
+    @staticmethod
+    def _to_results(points: List[models.ScoredPoint]) -> list[dict]:
+        return [
             {
                 "id": point.id,
                 "metadata": point.payload.get("metadata"),
                 "context": point.payload.get("value"),
                 "score": point.score,
             }
-            for point in response.points
+            for point in points
         ]
 
-        return results
+    def _get_loop_state(self) -> _LoopState:
+        """
+        Get the async search machinery of the running event loop, starting the task
+        sending the queued searches. A new one is created for every loop, e.g. for
+        every asyncio.run call, and when the task of the loop is gone.
+        :return: the state of the running loop
+        """
+        loop = asyncio.get_running_loop()
+        with self._loop_states_lock:
+            state = self._loop_states.get(loop)
+            if state is None or state.batcher.done():
+                # Forget the loops closed since, like those of the finished asyncio.run
+                for closed_loop in [loop for loop in self._loop_states if loop.is_closed()]:
+                    del self._loop_states[closed_loop]
+                state = _LoopState(self._create_async_client())
+                state.batcher = loop.create_task(self._run_query_batcher(state))
+                self._loop_states[loop] = state
+            return state
+
+    async def _run_query_batcher(self, state: _LoopState) -> None:
+        """
+        Send the queued searches to Qdrant. The searches queued within
+        QUERY_BATCH_WAIT_SEC are sent together, up to QUERY_BATCH_SIZE per request.
+        A search queued alone is sent right away, so it does not wait for others.
+        Both can be tuned with the QDRANT_QUERY_BATCH_WAIT_SEC and
+        QDRANT_QUERY_BATCH_SIZE environment variables.
+        :param state: the state of the running loop, with the queue of the search
+                      requests and the futures of their results, and the client
+                      closed when the task ends
+        """
+        queue = state.queue
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = [await queue.get()]
+                if not queue.empty():
+                    deadline = loop.time() + QUERY_BATCH_WAIT_SEC
+                    while len(batch) < QUERY_BATCH_SIZE:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            batch.append(await asyncio.wait_for(queue.get(), timeout))
+                        except asyncio.TimeoutError:
+                            break
+
+                # The batches are sent concurrently, a slow one does not hold the others
+                task = asyncio.create_task(self._send_query_batch(state, batch))
+                state.tasks.add(task)
+                task.add_done_callback(state.tasks.discard)
+        finally:
+            # The task is cancelled when the loop shuts down, e.g. at the end of
+            # asyncio.run, while the connections of the client can still be closed
+            await state.client.close()
+
+    async def _send_query_batch(self, state: _LoopState, batch: List[tuple]) -> None:
+        """
+        Send a batch of searches to Qdrant and resolve their futures. At most
+        QUERY_MAX_INFLIGHT batches are sent at the same time, the others wait, which
+        keeps the tail latency of the server stable under load. The limit can be
+        tuned with the QDRANT_MAX_INFLIGHT environment variable.
+        :param state: the state of the running loop
+        :param batch: the search requests and the futures of their results
+        """
+        client = state.client
+        requests = [request for request, _ in batch]
+        try:
+            async with state.inflight:
+                if len(requests) == 1:
+                    request = requests[0]
+                    responses = [
+                        await client.query_points(
+                            self.type,
+                            query=request.query,
+                            query_filter=request.filter,
+                            search_params=request.params,
+                            limit=request.limit,
+                            score_threshold=request.score_threshold,
+                            with_payload=request.with_payload,
+                            with_vectors=False,
+                        )
+                    ]
+                else:
+                    responses = await client.query_batch_points(
+                        self.type, requests=requests
+                    )
+        except Exception as e:
+            for _, future in batch:
+                # The waiting search may have been cancelled meanwhile
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response.points)
+
+    def _create_async_client(self) -> AsyncQdrantClient:
+        """
+        Create an async client of the storage. Its connections belong to the event loop
+        they are opened in, so unlike the sync client it is not shared process-wide.
+        :return: the client
+        """
+        return AsyncQdrantClient(
+            self._qdrant_location,
+            api_key=self._qdrant_api_key,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            grpc_port=QDRANT_GRPC_PORT,
+        )
+
+    def add_cache(self, cache: Any) -> None:
+        """
+        Register a cache of the search results. It is cleared whenever the collection
+        is changed through any storage of the process, see invalidate_cache.
+        :param cache: the cache, with a clear method; only weakly referenced
+        """
+        _SEARCH_CACHES[(self._qdrant_location, self.type)].add(cache)
+
+    def invalidate_cache(self) -> None:
+        """
+        Clear the caches of the search results of the collection.
+        """
+        for cache in list(_SEARCH_CACHES[(self._qdrant_location, self.type)]):
+            cache.clear()
 
     def reset(self) -> None:
         self.app.delete_collection(self.type)
+        self.invalidate_cache()
 
     def save(self, value: str, metadata: Dict[str, Any]) -> None:
         # Limit the document length to avoid it being too large for the model
@@ -76,18 +427,73 @@ class QdrantStorage(RAGStorage):
             self.type,
             points=[
                 models.PointStruct(
-                    id=uuid.uuid4().hex,
+                    id=self._point_id(value, metadata),
                     vector=embedding,
                     payload={"value": value, "metadata": metadata},
                 )
             ],
         )
+        self.invalidate_cache()
+
+    def save_many(self, values: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """
+        Save multiple values at once. All the values are embedded with a single call
+        to the embedder and stored with a single upsert.
+        :param values: the texts to store
+        :param metadatas: the metadata of each value, in the same order
+        """
+        if not values:
+            return
+
+        points = self._build_points(values, metadatas)
+
+        # Small batches fit into a single request, the large ones are split. They are
+        # applied before returning, so the caches are cleared after them.
+        if len(points) > UPLOAD_BATCH_SIZE:
+            self.app.upload_points(
+                collection_name=self.type,
+                points=points,
+                batch_size=UPLOAD_BATCH_SIZE,
+                parallel=1,
+                wait=True,
+            )
+        else:
+            self.app.upsert(self.type, points=points)
+        self.invalidate_cache()
+
+    def replace_by_filter(
+        self, filter: dict, values: List[str], metadatas: List[Dict[str, Any]]
+    ) -> None:
+        """
+        Replace the points matching the filter with the given values. The delete and
+        the upsert are sent in one request and applied in order, but not atomically,
+        so a concurrent search may still run between them.
+        :param filter: the filter of the points to replace
+        :param values: the texts to store
+        :param metadatas: the metadata of each value, in the same order
+        """
+        operations = [
+            models.DeleteOperation(
+                delete=models.FilterSelector(filter=self._to_qdrant_filter(filter))
+            )
+        ]
+        if values:
+            operations.append(
+                models.UpsertOperation(
+                    upsert=models.PointsList(
+                        points=self._build_points(values, metadatas)
+                    )
+                )
+            )
+        self.app.batch_update_points(self.type, update_operations=operations)
+        self.invalidate_cache()
 
     def delete(self, filter: Optional[dict] = None) -> None:
         self.app.delete(
             self.type,
             points_selector=self._to_qdrant_filter(filter),
         )
+        self.invalidate_cache()
 
     def count(self, filter: Optional[dict] = None) -> int:
         return self.app.count(
@@ -95,12 +501,46 @@ class QdrantStorage(RAGStorage):
             count_filter=self._to_qdrant_filter(filter),
         ).count
 
+    def _build_points(
+        self, values: List[str], metadatas: List[Dict[str, Any]]
+    ) -> List[models.PointStruct]:
+        """
+        Embed the values with a single call to the embedder and build the points.
+        :param values: the texts to store
+        :param metadatas: the metadata of each value, in the same order
+        :return: the points
+        """
+        # Limit the document length to avoid it being too large for the model
+        values = [self._normalize_text(value) for value in values]
+
+        embeddings = self.embedder_config(values)
+        return [
+            models.PointStruct(
+                id=self._point_id(value, metadata),
+                vector=embedding,
+                payload={"value": value, "metadata": metadata},
+            )
+            for value, metadata, embedding in zip(values, metadatas, embeddings)
+        ]
+
+    def _point_id(self, value: str, metadata: Dict[str, Any]) -> str:
+        """
+        Derive the point ID from its source and content, so storing the same content
+        again overwrites the existing point instead of creating a duplicate.
+        :param value: the normalized text of the point
+        :param metadata: the metadata of the point
+        :return: the point ID
+        """
+        source = metadata.get("notion_page_id") or metadata.get("src_path") or ""
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).hexdigest()
+        return uuid.uuid5(POINT_ID_NAMESPACE, f"{source}::{digest}").hex
+
     def _initialize_app(self):
         # Initialize the embedder from given config
         self._set_embedder_config()
 
         # Initialize the Qdrant client and create the collection if it doesn't exist
-        client = QdrantClient(self._qdrant_location, api_key=self._qdrant_api_key)
+        client = _get_client(self._qdrant_location, self._qdrant_api_key)
         if not client.collection_exists(self.type):
             # Create an embedding for a dummy value to get the embedding dimensionality
             embedding = self.embedder_config([self.TEST_STRING])[0]
@@ -111,16 +551,22 @@ class QdrantStorage(RAGStorage):
                 vectors_config=models.VectorParams(
                     size=len(embedding),
                     distance=models.Distance.COSINE,
+                    on_disk=True,
                 ),
+                quantization_config=self.QUANTIZATION_CONFIG,
             )
 
-            # Create a payload index for the filename
+        # Create the payload indexes of the filtered fields, also on the collections
+        # created before the index was introduced. The quantization is only set on
+        # creation, as changing it makes Qdrant re-optimize the whole collection.
+        payload_schema = client.get_collection(self.type).payload_schema
+        for field_name, field_schema in self.PAYLOAD_INDEXES.items():
+            if field_name in payload_schema:
+                continue
             client.create_payload_index(
                 collection_name=self.type,
-                field_name="src_path",
-                field_schema=models.KeywordIndexParams(
-                    type=models.KeywordIndexType.KEYWORD
-                ),
+                field_name=field_name,
+                field_schema=field_schema,
             )
         self.app = client
 
@@ -130,9 +576,10 @@ class QdrantStorage(RAGStorage):
         :param text:
         :return:
         """
-        text = text.encode("utf-8")[: self.MAX_LENGTH_BYTES]
-        text = text.decode("utf-8")
-        return text
+        # A character takes at least one byte, so the longer texts can be cut before
+        # encoding. Ignoring the errors drops a character split at the byte limit.
+        encoded = text[: self.MAX_LENGTH_BYTES].encode("utf-8")[: self.MAX_LENGTH_BYTES]
+        return encoded.decode("utf-8", errors="ignore")
 
     def _to_qdrant_filter(self, filter: Optional[dict]) -> Optional[models.Filter]:
         """
@@ -143,19 +590,13 @@ class QdrantStorage(RAGStorage):
         if filter is None:
             return None
 
-        must = []
-        for key, value in filter.items():
-            must.append(
-                models.FieldCondition(
-                    key=f"metadata.{key}",
-                    match=models.MatchValue(value=value),
-                )
-            )
-        return models.Filter(must=must)
+        return models.Filter(
+            must=[_field_condition(key, value) for key, value in filter.items()]
+        )
 
     def _set_embedder_config(self):
         """Override the default embedder configuration to use Google's embeddings."""
-        if isinstance(self.embedder_config, dict):
+        if isinstance(self.embedder_config, Mapping):
             provider = self.embedder_config.get('provider', '').lower()
             if provider == 'google':
                 from langchain_google_genai import GoogleGenerativeAIEmbeddings
@@ -171,6 +612,89 @@ class QdrantStorage(RAGStorage):
             # If embedder_config is already a function, use it as is
             pass
 
+    @contextlib.contextmanager
+    def deferred_indexing(self):
+        """
+        Disable the vector indexing for the duration of a bulk load, so Qdrant does not
+        rebuild the HNSW graph while the points are coming in. The previous threshold is
+        restored afterwards, and the index is built once.
+        """
+        collection = self.app.get_collection(self.type)
+        # The server default applies when the collection has no explicit threshold
+        previous_threshold = (
+            collection.config.optimizer_config.indexing_threshold
+            or self.DEFAULT_INDEXING_THRESHOLD
+        )
+        logger.info(
+            "Disabling the indexing of %s, %i points stored",
+            self.type,
+            collection.points_count or 0,
+        )
+        self.app.update_collection(
+            self.type,
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+        )
+        try:
+            yield
+        finally:
+            self.app.update_collection(
+                self.type,
+                optimizers_config=models.OptimizersConfigDiff(
+                    indexing_threshold=previous_threshold
+                ),
+            )
+            logger.info(
+                "Restored the indexing of %s, %i points stored",
+                self.type,
+                self.app.count(self.type).count,
+            )
+
+    def get_all_src_paths(self) -> set:
+        """
+        Get the paths of all the files stored in Qdrant, with a single paginated scroll.
+        :return: the set of the file paths
+        """
+        scroll_filter = models.Filter(
+            must_not=[
+                models.IsEmptyCondition(
+                    is_empty=models.PayloadField(key="metadata.src_path")
+                )
+            ]
+        )
+        return {
+            payload["metadata"]["src_path"]
+            for payload in self._iter_payloads(["metadata.src_path"], scroll_filter)
+        }
+
+    def _iter_payloads(
+        self,
+        payload_keys: List[str],
+        scroll_filter: Optional[models.Filter] = None,
+        batch_size: int = 1000,
+    ) -> Iterable[Dict[str, Any]]:
+        """
+        Iterate over the payloads of all the points matching the filter. Only the given
+        payload keys are loaded, and the vectors are skipped.
+        :param payload_keys: the payload keys to load
+        :param scroll_filter: the filter of the points, all the points by default
+        :param batch_size: the number of points loaded per request
+        :return: a generator of the payloads
+        """
+        offset = None
+        while True:
+            points, offset = self.app.scroll(
+                collection_name=self.type,
+                scroll_filter=scroll_filter,
+                limit=batch_size,
+                offset=offset,
+                with_payload=payload_keys,
+                with_vectors=False,
+            )
+            for point in points:
+                yield point.payload or {}
+            if offset is None:
+                break
+
     def get_all_page_ids(self) -> set:
         """
         Get all Notion page IDs stored in Qdrant
@@ -178,25 +702,19 @@ class QdrantStorage(RAGStorage):
             set: Set of page IDs
         """
         try:
-            # Search for all points with notion_page_id in metadata
-            results = self.app.scroll(
-                collection_name=self.type,
-                scroll_filter=models.Filter(
-                    must=[
-                        models.FieldCondition(
-                            key="metadata.notion_page_id",
-                            match=models.MatchValue(value={"$exists": True}),
-                        )
-                    ]
-                ),
-                limit=100  # Adjust based on your needs
+            # Only the points having a Notion page ID in their metadata
+            scroll_filter = models.Filter(
+                must_not=[
+                    models.IsEmptyCondition(
+                        is_empty=models.PayloadField(key="metadata.notion_page_id")
+                    )
+                ]
             )
-            
             page_ids = set()
-            for batch in results:
-                for point in batch[0]:
-                    if point.payload and "notion_page_id" in point.payload:
-                        page_ids.add(point.payload["notion_page_id"])
+            for payload in self._iter_payloads(
+                ["metadata.notion_page_id"], scroll_filter
+            ):
+                page_ids.add(payload["metadata"]["notion_page_id"])
             return page_ids
         except Exception as e:
             logger.error(f"Error getting page IDs from Qdrant: {e}")
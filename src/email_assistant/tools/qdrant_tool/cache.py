@@ -0,0 +1,255 @@
+import threading
+import time
+from typing import Hashable, Optional, Sequence
+
+import numpy as np
+from cachetools import TTLCache
+
+
+class _CountingTTLCache(TTLCache):
+    """
+    TTL cache counting the entries evicted to make room for the new ones.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
+
+class ResultCache:
+    """
+    Thread-safe cache of the search results, by the exact query. The entries expire
+    after a while, and the whole cache is cleared whenever the searched collection
+    changes, see QdrantStorage.add_cache.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_sec: float = 300):
+        """
+        :param max_size: the maximal number of entries, the least recently used are evicted
+        :param ttl_sec: the time after which an entry expires
+        """
+        self._lock = threading.RLock()
+        self._cache = _CountingTTLCache(maxsize=max_size, ttl=ttl_sec)
+        # Incremented on every clear, so a search started before the collection
+        # changed does not store its stale results afterwards
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[list[dict]]:
+        """
+        Get the cached results.
+        :param key: the key of the query
+        :return: the results, which must not be modified, or None on a cache miss
+        """
+        with self._lock:
+            results = self._cache.get(key)
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return results
+
+    def put(self, key: Hashable, results: list[dict], generation: int) -> None:
+        """
+        Cache the results, unless the cache was cleared since the search started.
+        :param key: the key of the query
+        :param results: the results of the query
+        :param generation: the generation of the cache when the search started
+        """
+        with self._lock:
+            if generation == self.generation:
+                self._cache[key] = results
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self.generation += 1
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of the cache.
+        :return: the hits, misses, evictions, hit rate and current size of the cache
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self._cache.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "currsize": len(self._cache),
+                "maxsize": self._cache.maxsize,
+            }
+
+
+class SemanticQueryCache:
+    """
+    Cache of the search results, looked up by the similarity of the query embeddings,
+    so the paraphrases of an already answered query do not hit Qdrant again.
+
+    The cached embeddings are L2-normalized rows of a single matrix, so the lookup is
+    one matrix-vector product. The rows are quantized to int8 with a scale per row,
+    which takes a quarter of the memory of float32, at the cost of a similarity error
+    far below the threshold resolution. Only the cached side is quantized, the query
+    is kept in float32. Each entry has its own similarity threshold: the entries
+    whose results were weak (no results, or a low best score) sit in a poorly covered
+    region of the knowledge base, where a close paraphrase may still find something
+    else, so they require a closer match.
+
+    Like ResultCache, the entries expire, and the cache is cleared whenever the
+    searched collection changes.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_size: int = 2048,
+        max_threshold: float = 0.99,
+        threshold_step: float = 0.02,
+        min_score: float = 0.5,
+        ttl_sec: float = 300,
+    ):
+        """
+        :param threshold: the minimal cosine similarity of a cache hit
+        :param max_size: the maximal number of entries, the least recently used are evicted
+        :param max_threshold: the maximal threshold of an entry with weak results
+        :param threshold_step: the raise of the threshold of an entry with weak results
+        :param min_score: the best score below which the results are considered weak
+        :param ttl_sec: the time after which an entry expires
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.max_threshold = max_threshold
+        self.threshold_step = threshold_step
+        self.min_score = min_score
+        self.ttl_sec = ttl_sec
+
+        self._lock = threading.Lock()
+        self._size = 0
+        self._clock = 0
+        # Incremented on every clear, see ResultCache.generation
+        self.generation = 0
+        # The arrays are allocated on the first entry, once the dimensionality is known
+        self._embeddings: Optional[np.ndarray] = None
+        self._scales = np.empty(max_size, dtype=np.float32)
+        self._thresholds = np.empty(max_size, dtype=np.float32)
+        self._limits = np.empty(max_size, dtype=np.int64)
+        self._last_used = np.empty(max_size, dtype=np.int64)
+        self._expires = np.empty(max_size, dtype=np.float64)
+        self._results: list[Optional[list[dict]]] = [None] * max_size
+
+    def get(self, embedding: Sequence[float], limit: int) -> Optional[list[dict]]:
+        """
+        Get the results cached for a similar enough query.
+        :param embedding: the embedding of the query
+        :param limit: the number of results requested
+        :return: the cached results, or None on a cache miss
+        """
+        return self.get_many([embedding], limit)[0]
+
+    def get_many(
+        self, embeddings: Sequence[Sequence[float]], limit: int
+    ) -> list[Optional[list[dict]]]:
+        """
+        Get the results cached for several queries at once. All the queries are
+        compared to all the entries with a single matrix product.
+        :param embeddings: the embeddings of the queries
+        :param limit: the number of results requested for each query
+        :return: the cached results of each query, None on a cache miss
+        """
+        queries = self._normalize(embeddings)
+        with self._lock:
+            if self._size == 0:
+                return [None] * len(queries)
+            size = self._size
+            # The similarities of the entries (rows) to the queries (columns)
+            similarities = (self._embeddings[:size] @ queries.T) * self._scales[
+                :size, np.newaxis
+            ]
+            # The entries with fewer results than requested cannot answer the queries,
+            # and neither can the expired ones
+            similarities[self._limits[:size] < limit] = -1.0
+            similarities[self._expires[:size] <= time.monotonic()] = -1.0
+            similarities -= self._thresholds[:size, np.newaxis]
+            indexes = np.argmax(similarities, axis=0)
+            margins = similarities[indexes, np.arange(len(queries))]
+
+            results = []
+            for index, margin in zip(indexes.tolist(), margins.tolist()):
+                if margin < 0:
+                    results.append(None)
+                    continue
+                self._clock += 1
+                self._last_used[index] = self._clock
+                results.append(self._results[index][:limit])
+            return results
+
+    def put(
+        self,
+        embedding: Sequence[float],
+        limit: int,
+        results: list[dict],
+        generation: int,
+    ) -> None:
+        """
+        Cache the results of a query, unless the cache was cleared since the search
+        started.
+        :param embedding: the embedding of the query
+        :param limit: the number of results requested
+        :param results: the results of the query
+        :param generation: the generation of the cache when the search started
+        """
+        query = self._normalize(embedding)
+        weak = not results or results[0]["score"] < self.min_score
+        with self._lock:
+            if generation != self.generation:
+                return
+            if self._embeddings is None:
+                self._embeddings = np.empty(
+                    (self.max_size, query.shape[0]), dtype=np.int8
+                )
+            if self._size < self.max_size:
+                index = self._size
+                self._size += 1
+            else:
+                # Replace an expired entry first, the least recently used otherwise
+                expired = np.flatnonzero(self._expires <= time.monotonic())
+                if expired.size:
+                    index = int(expired[0])
+                else:
+                    index = int(np.argmin(self._last_used))
+            self._clock += 1
+            self._embeddings[index], self._scales[index] = self._quantize(query)
+            self._thresholds[index] = (
+                min(self.threshold + self.threshold_step, self.max_threshold)
+                if weak
+                else self.threshold
+            )
+            self._limits[index] = limit
+            self._last_used[index] = self._clock
+            self._expires[index] = time.monotonic() + self.ttl_sec
+            self._results[index] = results
+
+    def clear(self) -> None:
+        with self._lock:
+            self._size = 0
+            self._results = [None] * self.max_size
+            self.generation += 1
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        # Normalizes a single embedding, or each row of a matrix of embeddings
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    @staticmethod
+    def _quantize(vector: np.ndarray) -> tuple[np.ndarray, float]:
+        # Symmetric quantization, the largest component is mapped to 127
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype(np.int8), scale
@@ -1,17 +1,284 @@
+import asyncio
+import copy
+import functools
+import hashlib
 import logging
-from typing import Type, Any
+import os
+import queue
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Type, Any, Iterable, Optional, Sequence
 
+import numpy as np
+import orjson
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
 
 from email_assistant.storage import QdrantStorage
+from email_assistant.tools.qdrant_tool.cache import ResultCache, SemanticQueryCache
 
 logger = logging.getLogger(__name__)
 
+# The payload fields returned to the agents by default, None for the whole payload, so
+# the agents get all the metadata of the chunks, including the frontmatter of the notes
+DEFAULT_FIELDS = None
+
+# The queries of the agents, used to warm the caches up on the next start. The queries
+# may quote the emails, so they are only persisted if KNOWLEDGE_BASE_QUERY_LOG is true.
+HOT_QUERIES_PATH = Path.home() / ".cache" / "email_assistant" / "hot_queries.jsonl"
+HOT_QUERIES_ENABLED = os.environ.get("KNOWLEDGE_BASE_QUERY_LOG", "").lower() == "true"
+
+
+class _QueryLog:
+    """
+    Log of the searched queries and their counts, readable by the owner only. The
+    queries are appended by a background thread, so the searches never wait for the
+    disk, and the log is regularly compacted to the most frequent queries.
+    """
+
+    # The number of queries kept by the compaction
+    MAX_QUERIES = 1000
+    # The number of appended queries after which the log is compacted
+    COMPACT_EVERY = 1000
+
+    def __init__(self, path: Path, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self._queue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    def record(self, query: str) -> None:
+        """
+        Append the query to the log, eventually. Nothing happens if the log is disabled.
+        :param query: the searched query
+        """
+        if not self.enabled:
+            return
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._run_writer, name="query-log", daemon=True
+                    )
+                    self._writer.start()
+        self._queue.put(query)
+
+    def most_common(self, count: int) -> list[str]:
+        """
+        Get the most frequent queries of the log.
+        :param count: the maximal number of queries to return
+        :return: the queries, the most frequent first, none if the log is disabled
+        """
+        if not self.enabled:
+            return []
+        return [query for query, _ in self._load_counts().most_common(count)]
+
+    def _load_counts(self) -> Counter:
+        counts = Counter()
+        if not self.path.exists():
+            return counts
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    query, count = orjson.loads(line)
+                    counts[query] += count
+                except (ValueError, TypeError):
+                    # The last line may be cut if the process was killed while writing
+                    continue
+        return counts
+
+    def _open(self, path: Path, flags: int):
+        return os.fdopen(os.open(path, flags, 0o600), "wb")
+
+    def _compact(self) -> None:
+        """
+        Rewrite the log with the most frequent queries only, with their counts.
+        """
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with self._open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC) as f:
+            for entry in self._load_counts().most_common(self.MAX_QUERIES):
+                f.write(orjson.dumps(entry) + b"\n")
+        tmp_path.replace(self.path)
+
+    def _run_writer(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._compact()
+        appended = 0
+        append_flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        f = self._open(self.path, append_flags)
+        try:
+            while True:
+                queries = [self._queue.get()]
+                # Write all the pending queries before flushing
+                try:
+                    while True:
+                        queries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                f.write(b"".join(orjson.dumps([query, 1]) + b"\n" for query in queries))
+                f.flush()
+
+                appended += len(queries)
+                if appended >= self.COMPACT_EVERY:
+                    f.close()
+                    self._compact()
+                    appended = 0
+                    f = self._open(self.path, append_flags)
+        finally:
+            f.close()
+
+
+_query_log = _QueryLog(HOT_QUERIES_PATH, enabled=HOT_QUERIES_ENABLED)
+
+
+@functools.lru_cache(maxsize=None)
+def _result_cache(storage: QdrantStorage) -> ResultCache:
+    """
+    Get the cache of the results of the exact queries of the given storage, shared by
+    all the tools using it. The agents often repeat the same query, and a hit skips
+    both the embedding model and the Qdrant round-trip.
+    :param storage: the storage to search in
+    :return: the cache, cleared whenever the collection changes
+    """
+    cache = ResultCache()
+    storage.add_cache(cache)
+    return cache
+
+
+@functools.lru_cache(maxsize=None)
+def _semantic_cache(
+    storage: QdrantStorage, fields: Optional[tuple]
+) -> SemanticQueryCache:
+    """
+    Get the semantic cache of the given storage, shared by all the tools using it.
+    The results with different payload fields are cached separately.
+    :param storage: the storage to search in
+    :param fields: the payload fields of the cached results, None for the whole payload
+    :return: the cache, cleared whenever the collection changes
+    """
+    cache = SemanticQueryCache()
+    storage.add_cache(cache)
+    return cache
+
+
+@functools.lru_cache(maxsize=4096)
+def _embed(storage: QdrantStorage, query: str) -> np.ndarray:
+    """
+    Embed the query with the embedder of the storage, memoizing the embeddings. The
+    embedding call dominates the latency of a search, and the same query may be
+    searched with different limits or payload fields.
+    :param storage: the storage whose embedder is used
+    :param query: the query to embed
+    :return: the read-only embedding
+    """
+    # A float32 array takes a fraction of the memory of a list of Python floats
+    embedding = np.asarray(storage.embed(query), dtype=np.float32)
+    embedding.flags.writeable = False
+    return embedding
+
+
+def _cached_search(
+    storage: QdrantStorage, query: str, limit: int, fields: Optional[tuple]
+) -> list[dict]:
+    """
+    Search the storage, through the caches of its results. On an exact cache miss,
+    the query is embedded and the results of a paraphrased query are reused if there
+    are any, so only the Qdrant round-trip is skipped.
+    :param storage: the storage to search in
+    :param query: the query to search for
+    :param limit: the number of results to return
+    :param fields: the payload fields to return, None for the whole payload
+    :return: the cached results, which must not be modified by the caller
+    """
+    result_cache = _result_cache(storage)
+    results = result_cache.get((query, limit, fields))
+    if results is not None:
+        return results
+
+    generation = result_cache.generation
+    semantic_cache = _semantic_cache(storage, fields)
+    semantic_generation = semantic_cache.generation
+    embedding = _embed(storage, query)
+    results = semantic_cache.get(embedding, limit)
+    if results is None:
+        results = storage.search_vec(embedding.tolist(), limit, fields=fields)
+        semantic_cache.put(embedding, limit, results, semantic_generation)
+    result_cache.put((query, limit, fields), results, generation)
+    return results
+
+
+def _clamp_limit(limit: Optional[int]) -> int:
+    # The arguments are not validated against SearchInput on every path, e.g. when
+    # the tool is called directly, so the limit is brought into its bounds here
+    return 10 if limit is None else max(1, min(100, int(limit)))
+
+
+def _normalize_fields(fields: Optional[Sequence[str]]) -> Optional[tuple]:
+    # The fields are part of the cache keys, so they have to be hashable
+    return tuple(fields) if fields else DEFAULT_FIELDS
+
+
+def _log_query(query: str, limit: int) -> None:
+    # The queries may quote the emails, so only their length and hash are logged,
+    # and nothing is computed unless the debug logs are enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Received a query to search in the knowledge base: len=%i hash=%s limit=%s",
+            len(query),
+            hashlib.blake2b(query.encode("utf-8"), digest_size=6).hexdigest(),
+            limit,
+        )
+
+
+async def parallel_retrieve(query: str, sources: Sequence[Any], k: int) -> list[dict]:
+    """
+    Search all the sources concurrently, so the retrieval takes as long as the slowest
+    source instead of the sum of all of them. A failing source is logged and skipped.
+    :param query: the query to search for
+    :param sources: the objects with an async asearch(query, limit) method, like
+                    QdrantStorage or QdrantSearchTool
+    :param k: the number of results to get from each source
+    :return: the results of all the sources, in their order, without the duplicates
+    """
+    tasks = [asyncio.create_task(source.asearch(query, k)) for source in sources]
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = []
+    seen_hashes = set()
+    for source, response in zip(sources, responses):
+        if isinstance(response, BaseException):
+            logger.error("Error searching in %s: %s", source, response)
+            continue
+        for result in response:
+            # The same content may be stored in several sources
+            content_hash = hashlib.blake2b(
+                str(result.get("context")).encode("utf-8"), digest_size=16
+            ).digest()
+            if content_hash in seen_hashes:
+                continue
+            seen_hashes.add(content_hash)
+            results.append(result)
+    return results
+
 
 class SearchInput(BaseModel):
-    query: str = Field(description="The query to search in the knowledge base.")
-    limit: str = Field(default=10, description="The number of results to return.")
+    query: str = Field(
+        min_length=1,
+        max_length=2048,
+        description="The query to search in the knowledge base.",
+    )
+    limit: int = Field(
+        default=10, ge=1, le=100, description="The number of results to return."
+    )
+    fields: Optional[list[str]] = Field(
+        default=None,
+        description=(
+            "The payload fields to return, like value or metadata.src_path. "
+            "All the fields are returned by default."
+        ),
+    )
 
 
 class QdrantSearchTool(BaseTool):
@@ -29,10 +296,132 @@ class QdrantSearchTool(BaseTool):
     def __init__(self, qdrant_storage: QdrantStorage, /, **data: Any):
         super().__init__(**data)
         self._qdrant_storage = qdrant_storage
+        # Bound once, as _run is called for every search of the agents
+        self._search = functools.partial(_cached_search, qdrant_storage)
 
-    def _run(self, query: str, limit: int = 10) -> list[dict]:
+    def _run(
+        self, query: str, limit: int = 10, fields: Optional[list[str]] = None
+    ) -> list[dict]:
         # This method signature reflects the input schema defined in args_schema.
         # We could also use *args, **kwargs, but this is more explicit.
-        logger.info("Received a query to search in the knowledge base: %s", query)
-        results = self._qdrant_storage.search(query, limit)
-        return results
+        limit = _clamp_limit(limit)
+        _log_query(query, limit)
+        _query_log.record(query)
+        results = self._search(query, limit, _normalize_fields(fields))
+        # The cached results are shared, so the caller gets its own copy
+        return copy.deepcopy(results)
+
+    async def _arun(
+        self, query: str, limit: int = 10, fields: Optional[list[str]] = None
+    ) -> list[dict]:
+        # The async counterpart of _run, so the concurrent tool calls do not wait
+        # for each other. The caches are shared with the sync path.
+        limit = _clamp_limit(limit)
+        fields = _normalize_fields(fields)
+        _log_query(query, limit)
+        _query_log.record(query)
+        storage = self._qdrant_storage
+        result_cache = _result_cache(storage)
+        results = result_cache.get((query, limit, fields))
+        if results is None:
+            generation = result_cache.generation
+            semantic_cache = _semantic_cache(storage, fields)
+            semantic_generation = semantic_cache.generation
+            # The embedder is synchronous, so it runs in a worker thread
+            embedding = await asyncio.to_thread(_embed, storage, query)
+            results = semantic_cache.get(embedding, limit)
+            if results is None:
+                results = await storage.asearch_vec(
+                    embedding.tolist(), limit, fields=fields
+                )
+                semantic_cache.put(embedding, limit, results, semantic_generation)
+            result_cache.put((query, limit, fields), results, generation)
+        return copy.deepcopy(results)
+
+    async def asearch_many(
+        self,
+        queries: Sequence[str],
+        limit: int = 10,
+        fields: Optional[Sequence[str]] = None,
+    ) -> list[list[dict]]:
+        """
+        Search several queries at once. The queries missing from the result cache are
+        embedded with a single call to the embedder and looked up in the semantic
+        cache with a single matrix product. The remaining ones are searched
+        concurrently, so Qdrant receives them in a single batch.
+        :param queries: the queries to search for
+        :param limit: the number of results to return for each query
+        :param fields: the payload fields to return, the whole payload by default
+        :return: the results of each query, in the same order
+        """
+        limit = _clamp_limit(limit)
+        fields = _normalize_fields(fields)
+        storage = self._qdrant_storage
+        result_cache = _result_cache(storage)
+        generation = result_cache.generation
+        semantic_cache = _semantic_cache(storage, fields)
+        semantic_generation = semantic_cache.generation
+        results = [result_cache.get((query, limit, fields)) for query in queries]
+        missing = [i for i, found in enumerate(results) if found is None]
+        if missing:
+            # The embedder is synchronous, so it runs in a worker thread
+            embeddings = np.asarray(
+                await asyncio.to_thread(
+                    storage.embed_many, [queries[i] for i in missing]
+                ),
+                dtype=np.float32,
+            )
+            missing_results = semantic_cache.get_many(embeddings, limit)
+            to_search = [j for j, found in enumerate(missing_results) if found is None]
+            searched = await asyncio.gather(
+                *(
+                    storage.asearch_vec(embeddings[j].tolist(), limit, fields=fields)
+                    for j in to_search
+                )
+            )
+            for j, found in zip(to_search, searched):
+                semantic_cache.put(embeddings[j], limit, found, semantic_generation)
+                missing_results[j] = found
+            for i, found in zip(missing, missing_results):
+                result_cache.put((queries[i], limit, fields), found, generation)
+                results[i] = found
+        return copy.deepcopy(results)
+
+    async def asearch(self, query: str, limit: int = 10) -> list[dict]:
+        """
+        Search the knowledge base with the caches of the tool, so the tool can be one
+        of the sources of parallel_retrieve.
+        :param query: the query to search for
+        :param limit: the number of results to return
+        :return: the results
+        """
+        return await self._arun(query, limit)
+
+    def warm_cache(
+        self, queries: Optional[Iterable[str]] = None, top_k: int = 100
+    ) -> None:
+        """
+        Fill the caches with the results of the given queries, so the first searches
+        after a start do not have to wait for the embedder and Qdrant.
+        :param queries: the queries to search for, by default the most frequent
+                        queries searched by the agents before
+        :param top_k: the number of the most frequent queries used by default
+        """
+        if queries is None:
+            queries = _query_log.most_common(top_k)
+        warmed = 0
+        for query in queries:
+            try:
+                # Searched directly, so the warm-up is not recorded as a query
+                self._search(query, 10, DEFAULT_FIELDS)
+                warmed += 1
+            except Exception as e:
+                logger.error("Error warming the cache up: %s", e)
+        logger.info("Warmed the knowledge base cache up with %i queries", warmed)
+
+    def cache_stats(self) -> dict:
+        """
+        Get the statistics of the search results cache.
+        :return: the hits, misses, evictions, hit rate, maximum and current size
+        """
+        return _result_cache(self._qdrant_storage).stats()